@@ -0,0 +1,107 @@
+# coding=utf-8
+"""Compares `gulpless.compress` against the `writelines` based
+`gulpless.gzip` helper it replaces, on text and binary assets.
+
+`python benchmarks/compress.py --files 32 --size 2097152`
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import gzip as _gzip
+import argparse
+import tempfile
+import random
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from gulpless.compress import compress, compress_all  # noqa: E402
+
+
+def writelines_gzip(original, compressed, *gzip_args, **gzip_kwargs):
+    """The original implementation of `gulpless.gzip`."""
+    orig = comp = None
+    try:
+        orig = open(original, "rb")
+        comp = _gzip.open(compressed, "wb", *gzip_args, **gzip_kwargs)
+        comp.writelines(orig)
+    finally:
+        if comp:
+            comp.close()
+        if orig:
+            orig.close()
+
+
+def generate(root, kind, files, size):
+    """Creates `files` files of `size` bytes. Text files are made of source
+    code like lines, binary ones are random (i.e. incompressible) bytes with
+    a few newlines sprinkled in, like most images and fonts."""
+    rng = random.Random(kind)
+    words = ["function", "return", "var", "this", "{", "}", "(", ")", ";",
+             "=", "value", "index", "length", "0", "1", "null", "if"]
+    paths = []
+    for i in range(files):
+        path = os.path.join(root, "{0}{1}".format(kind, i))
+        with open(path, "wb") as f:
+            if kind == "text":
+                chunk, length = [], 0
+                while length < size:
+                    chunk.append((" ".join(rng.choice(words) for j in
+                                           range(rng.randint(2, 12))) +
+                                  "\n").encode("ascii"))
+                    length += len(chunk[-1])
+                f.write(b"".join(chunk)[:size])
+            else:
+                data = bytearray(os.urandom(size))
+                for j in range(0, size, 64):
+                    data[j] = 10
+                f.write(bytes(data))
+        paths.append(path)
+    return paths
+
+
+def measure(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--size", type=int, default=1 << 20)
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="gulpless-bench-")
+    try:
+        print("{0:<8}{1:>16}{2:>16}{3:>16}".format(
+            "", "writelines (s)", "compress (s)", "parallel (s)"))
+        for kind in ["text", "binary"]:
+            files = [(path, path + ".gz") for path in
+                     generate(root, kind, args.files, args.size)]
+            old, new, parallel = [], [], []
+            for i in range(args.rounds):
+                old.append(measure(lambda: [
+                    writelines_gzip(original, compressed, args.level)
+                    for original, compressed in files
+                ]))
+                new.append(measure(lambda: [
+                    compress(original, compressed, "gzip", args.level)
+                    for original, compressed in files
+                ]))
+                parallel.append(measure(lambda: compress_all(
+                    files, "gzip", args.level)))
+            print("{0:<8}{1:>16.3f}{2:>16.3f}{3:>16.3f}".format(
+                kind, min(old), min(new), min(parallel)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
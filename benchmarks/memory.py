@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Measures how much memory gulpless keeps about synthetic source trees (see
+`suite.py`). Every tree size is measured in a separate process, once the
+first batch of an interactive restart (i.e. one that restored the state
+file) is complete:
+
+* `retained`: the memory allocated by Python that is still in use, in KiB
+* `per_file`: the same, in bytes per source file
+* `rss`: the peak resident set size of the process, in KiB
+
+`python benchmarks/memory.py --sizes 10000 100000 --output HEAD.json`
+`python benchmarks/memory.py --sizes 10000 100000 --compare HEAD.json`
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import tracemalloc
+import argparse
+import tempfile
+import logging
+import shutil
+import json
+import sys
+import gc
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import gulpless  # noqa: E402
+import suite  # noqa: E402
+
+
+def measure(args):
+    """Measures a single tree size, returning a dict of results."""
+    root = tempfile.mkdtemp(prefix="gulpless-memory-")
+    src, dest = os.path.join(root, "src"), os.path.join(root, "dest")
+    state = os.path.join(root, "state")
+    os.mkdir(src)
+    os.mkdir(dest)
+    try:
+        suite.generate(src, args.size, args.fanout, args.subfolders,
+                       args.roots, args.refs)
+
+        def reactor():
+            result = gulpless.Reactor(src, dest, bundle=0.05, state=state,
+                                      rescan=3600)
+            result.add_handler(suite.StubTreeHandler(["*.js"]))
+            result.add_handler(suite.StubHandler(["*.bin"]))
+            return result
+
+        # the cold build only writes the state file
+        current = reactor()
+        suite.run(current)
+        current.stop()
+        current.join()
+        del current
+        gc.collect()
+
+        tracemalloc.start()
+        current = reactor()
+        suite.run(current)
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        current.stop()
+        current.join()
+
+        return {
+            "size": args.size,
+            "retained": retained // 1024,
+            "per_file": retained // args.size,
+            "rss": suite._peak_rss()
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    suite.add_arguments(parser, [10000, 100000])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    if args.size:
+        # running as a child process
+        print(json.dumps(measure(args)))
+        return
+
+    columns = ["retained", "per_file", "rss"]
+    suite.report(args, suite.TREE, suite.run_sizes(__file__, args, suite.TREE),
+                 columns, dict.fromkeys(columns, "{0}"))
+
+
+if __name__ == "__main__":
+    main()
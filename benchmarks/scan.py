@@ -0,0 +1,130 @@
+# coding=utf-8
+"""Compares `gulpless.scanner.Scanner` against the `os.walk` based scan that
+`Proxy.changes` used to perform.
+
+`python benchmarks/scan.py --files 100000`
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import argparse
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from gulpless.scanner import Scanner  # noqa: E402
+
+
+class WalkScanner(object):
+    """The original implementation of `Proxy.changes`."""
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+    def scan(self):
+        deleted = []
+        for path in list(self.files):
+            isdir = path.endswith(os.sep)
+            abspath = os.path.join(self.path, path)
+            try:
+                is_deleted = (
+                    not os.path.exists(abspath) or
+                    os.path.isdir(abspath) != isdir
+                )
+            except EnvironmentError:
+                is_deleted = True
+
+            if is_deleted:
+                deleted.append(path)
+                del self.files[path]
+
+        changed = []
+        for folder, subfolders, subfiles in os.walk(self.path):
+            for path in subfolders:
+                path = os.path.join(folder, path)
+                path = os.path.normcase(os.path.relpath(path, self.path))
+                path += os.sep
+                if path not in self.files:
+                    self.files[path] = 0
+                    changed.append(path)
+
+            for path in subfiles:
+                actual_path = path = os.path.join(folder, path)
+                path = os.path.normcase(os.path.relpath(path, self.path))
+                try:
+                    mtime = os.path.getmtime(actual_path)
+                    if path not in self.files:
+                        self.files[path] = 0
+
+                    if mtime > self.files[path]:
+                        self.files[path] = mtime
+                        changed.append(path)
+                except EnvironmentError:
+                    if path in self.files:
+                        deleted.append(path)
+                        del self.files[path]
+        return changed, deleted
+
+
+def generate(root, files, fanout, subfolders):
+    """Creates `files` empty files in a tree where every folder has `fanout`
+    files and `subfolders` subfolders."""
+    folders = [root]
+    created = 0
+    while created < files:
+        folder = folders.pop(0)
+        for i in range(fanout):
+            if created == files:
+                break
+            open(os.path.join(folder, "file{0}.txt".format(i)), "w").close()
+            created += 1
+        for i in range(subfolders if created < files else 0):
+            subfolder = os.path.join(folder, "dir{0}".format(i))
+            os.mkdir(subfolder)
+            folders.append(subfolder)
+
+    # make sure folder mtimes are not considered recent
+    past = time.time() - 60
+    for folder, _, _ in os.walk(root):
+        os.utime(folder, (past, past))
+
+
+def measure(scanner):
+    start = time.time()
+    changed, deleted = scanner.scan()
+    return time.time() - start, len(changed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--fanout", type=int, default=16)
+    parser.add_argument("--subfolders", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="gulpless-bench-")
+    try:
+        generate(root, args.files, args.fanout, args.subfolders)
+        print("{0:<12}{1:>12}{2:>12}{3:>12}".format("", "entries",
+                                                    "cold (s)", "no-op (s)"))
+        for name, cls in [("os.walk", WalkScanner), ("scandir", Scanner)]:
+            cold, noop = [], []
+            for i in range(args.rounds):
+                scanner = cls(root)
+                elapsed, entries = measure(scanner)
+                cold.append(elapsed)
+                noop.append(measure(scanner)[0])
+            print("{0:<12}{1:>12}{2:>12.3f}{3:>12.3f}".format(
+                name, entries, min(cold), min(noop)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
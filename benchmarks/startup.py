@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Measures how long `gulpless build` takes from start to exit, the way a CI
+job runs it, on synthetic source trees (see `suite.py`). Every run is a
+separate process; each column is the median of `--repeat` runs, in seconds:
+
+* `import`: `import gulpless` alone
+* `cold`: the first build of an empty output folder
+* `noop`: a build that doesn't find anything to do, with and without a
+  state file
+
+`python benchmarks/startup.py --sizes 100 1000 10000 --output HEAD.json`
+`python benchmarks/startup.py --sizes 100 1000 10000 --compare HEAD.json`
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import subprocess
+import argparse
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+import suite
+
+BUILD = """import logging
+import sys
+import os
+sys.path.insert(0, {benchmarks!r})
+import suite
+SRC, DEST = "src", "dest"
+STATE = os.environ.get("STARTUP_STATE") or None
+HANDLERS = [suite.StubTreeHandler(["*.js"]), suite.StubHandler(["*.bin"])]
+LOGGING = logging.WARNING
+"""
+
+
+def _time(argv, state=None):
+    """Runs `argv` with the working copy's gulpless, returning how long it
+    took."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__)))
+    env["STARTUP_STATE"] = state or ""
+    start = time.time()
+    subprocess.check_call(argv, env=env)
+    return time.time() - start
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(args, size):
+    """Benchmarks a single tree size, returning a dict of results."""
+    root = tempfile.mkdtemp(prefix="gulpless-startup-")
+    src, dest = os.path.join(root, "src"), os.path.join(root, "dest")
+    os.mkdir(src)
+    try:
+        suite.generate(src, size, args.fanout, args.subfolders, args.roots,
+                       args.refs)
+        with open(os.path.join(root, "build.py"), "w") as f:
+            f.write(BUILD.format(benchmarks=os.path.dirname(
+                os.path.abspath(__file__))))
+
+        build = [sys.executable, "-c", "import gulpless; gulpless.main()",
+                 "-d", root, "build"]
+        results = {"size": size, "cold": [], "noop": [],
+                   "noop_stateless": []}
+        for i in range(args.repeat):
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            os.mkdir(dest)
+            state = os.path.join(root, "state{0}".format(i))
+            results["cold"].append(_time(build, state))
+            results["noop"].append(_time(build, state))
+            results["noop_stateless"].append(_time(build))
+        for name in ["cold", "noop", "noop_stateless"]:
+            results[name] = _median(results[name])
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    suite.add_arguments(parser, [100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    imported = _median([_time([sys.executable, "-c", "import gulpless"])
+                        for i in range(args.repeat)])
+    results = [dict(measure(args, size), **{"import": imported})
+               for size in args.sizes]
+    suite.report(args, suite.TREE + ["repeat"], results,
+                 ["import", "cold", "noop", "noop_stateless"])
+
+
+if __name__ == "__main__":
+    main()
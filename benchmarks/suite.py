@@ -0,0 +1,289 @@
+# coding=utf-8
+"""Measures how gulpless scales on synthetic source trees. Every tree size is
+benchmarked in a separate process (so that peak memory usage can be
+measured) through the whole `Reactor` / `Collector` / `Proxy` stack, using
+stub handlers that don't start any tools:
+
+* `cold`: the first build of an empty output folder
+* `noop`: a restart that doesn't find anything to build, with and without
+  a state file
+* `edit`: the time between a file being changed and its root being rebuilt
+* `rss`: the peak resident set size of the process, in KiB
+
+`python benchmarks/suite.py --sizes 1000 10000 --output HEAD.json`
+`python benchmarks/suite.py --sizes 1000 10000 --compare HEAD.json`
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import subprocess
+import threading
+import argparse
+import platform
+import tempfile
+import logging
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import gulpless  # noqa: E402
+
+
+class StubTreeHandler(gulpless.TreeHandler):
+    """Writes an empty output for every root and remembers when each one of
+    them was last built."""
+    def __init__(self, patterns):
+        super(StubTreeHandler, self).__init__(patterns, suffixes=[".out"])
+        self.built = {}
+        self.condition = threading.Condition()
+
+    def build(self, input_path, output_paths):
+        open(output_paths[0], "wb").close()
+        with self.condition:
+            self.built[input_path] = time.time()
+            self.condition.notify_all()
+
+
+class StubHandler(gulpless.Handler):
+    """Copies static files."""
+    def __init__(self, patterns):
+        super(StubHandler, self).__init__(patterns)
+
+
+def generate(root, files, fanout, subfolders, roots, refs, seed=0):
+    """Creates `files` files in a tree where every folder has `fanout` files
+    and `subfolders` subfolders. Half of them are scripts; a `roots` fraction
+    of those doesn't reference anything, the others reference up to `refs`
+    scripts that were created before them. The rest are static files. Returns
+    a list of (script, is_root) tuples."""
+    rng = random.Random(seed)
+    folders = [""]
+    scripts = []
+    created = 0
+    while created < files:
+        folder = folders.pop(0)
+        for i in range(fanout):
+            if created == files:
+                break
+            created += 1
+            if i % 2:
+                with open(os.path.join(root, folder, "file{0}.bin".format(
+                        i)), "wb") as f:
+                    f.write(b"static")
+                continue
+
+            path = os.path.join(folder, "file{0}.js".format(i))
+            lines = []
+            if scripts and rng.random() >= roots:
+                for j in range(rng.randint(1, refs)):
+                    parent = rng.choice(scripts)[0]
+                    lines.append("/// <base path=\"{0}\"/>\n".format(
+                        os.path.relpath(parent, folder or os.curdir).replace(
+                            os.sep, "/")))
+            lines.append("var x = {0};\n".format(created))
+            with open(os.path.join(root, path), "w") as f:
+                f.writelines(lines)
+            scripts.append((path, not lines))
+
+        for i in range(subfolders if created < files else 0):
+            subfolder = os.path.join(folder, "dir{0}".format(i))
+            os.mkdir(os.path.join(root, subfolder))
+            folders.append(subfolder)
+    return scripts
+
+
+def run(reactor, timeout=3600):
+    """Runs `reactor` until its first batch is complete."""
+    reactor.start()
+    deadline = time.time() + timeout
+    while reactor._initial and reactor.running and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def measure(args):
+    """Benchmarks a single tree size, returning a dict of results."""
+    root = tempfile.mkdtemp(prefix="gulpless-bench-")
+    src, dest = os.path.join(root, "src"), os.path.join(root, "dest")
+    state = os.path.join(root, "state")
+    os.mkdir(src)
+    os.mkdir(dest)
+    try:
+        start = time.time()
+        scripts = generate(src, args.size, args.fanout, args.subfolders,
+                           args.roots, args.refs)
+        results = {"size": args.size, "generate": time.time() - start}
+
+        def reactor(state, handler=None):
+            result = gulpless.Reactor(src, dest, bundle=args.bundle,
+                                      jobs=args.jobs, state=state,
+                                      rescan=3600)
+            result.add_handler(handler or StubTreeHandler(["*.js"]))
+            result.add_handler(StubHandler(["*.bin"]))
+            return result
+
+        for name, state_file in [("cold", state), ("noop", state),
+                                 ("noop_stateless", None)]:
+            current = reactor(state_file)
+            start = time.time()
+            run(current)
+            results[name] = time.time() - start
+            current.stop()
+            current.join()
+
+        # edit scripts that are included by others and wait for the roots
+        # that include them to be rebuilt
+        handler = StubTreeHandler(["*.js"])
+        current = reactor(state, handler)
+        run(current)
+        leaves = [path for path, is_root in scripts if not is_root]
+        latencies = []
+        for path in leaves[:args.edits]:
+            targets = [os.path.join(src, target) for target in
+                       handler.targets(src, path)]
+            time.sleep(0.05)
+            edited = time.time()
+            with open(os.path.join(src, path), "a") as f:
+                f.write("// edited\n")
+
+            deadline = edited + 60
+            with handler.condition:
+                while time.time() < deadline and not all(
+                        handler.built.get(target, 0) >= edited
+                        for target in targets):
+                    handler.condition.wait(0.1)
+            latencies.append(time.time() - edited)
+        current.stop()
+        current.join()
+
+        if latencies:
+            latencies.sort()
+            results["edit"] = latencies[len(latencies) // 2]
+            results["edit_max"] = latencies[-1]
+        results["rss"] = _peak_rss()
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def _peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, everything else KiB
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode("ascii").strip()
+    except (EnvironmentError, subprocess.CalledProcessError):
+        return None
+
+
+# the arguments that describe a synthetic tree (see `generate`)
+TREE = ["fanout", "subfolders", "roots", "refs"]
+
+
+def add_arguments(parser, sizes):
+    """Adds the arguments that every benchmark takes to `parser`: the tree
+    `sizes` to run, the shape of the trees, and where to save (or what to
+    compare) the results."""
+    parser.add_argument("--sizes", type=int, nargs="+", default=sizes)
+    parser.add_argument("--fanout", type=int, default=16)
+    parser.add_argument("--subfolders", type=int, default=4)
+    parser.add_argument("--roots", type=float, default=0.2,
+                        help="the fraction of scripts that are roots")
+    parser.add_argument("--refs", type=int, default=2,
+                        help="the most parents a script may reference")
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--compare", help="compare with a previous output")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+
+
+def run_sizes(script, args, names):
+    """Runs `script` once for every size in `args.sizes`, each in a separate
+    process that is passed the arguments in `names` along with `--size`,
+    and returns the results they printed as JSON on their last line."""
+    results = []
+    for size in args.sizes:
+        argv = [sys.executable, os.path.abspath(script)]
+        for name in names:
+            argv += ["--" + name, str(getattr(args, name))]
+        output = subprocess.check_output(argv + ["--size", str(size)])
+        results.append(json.loads(output.decode("utf-8").splitlines()[-1]))
+    return results
+
+
+def report(args, names, results, columns, formats={}):
+    """Prints a table with the `columns` of `results`, one row per tree
+    size, comparing them with the results in `args.compare`; every value is
+    shown in seconds unless `formats` maps its column to another format.
+    The results are then saved to `args.output` along with the arguments in
+    `names`."""
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = dict((result["size"], result) for result in
+                            json.load(f)["results"])
+
+    print("{0:<10}".format("files") + "".join("{0:>18}".format(column)
+                                              for column in columns))
+    for result in results:
+        line = "{0:<10}".format(result["size"])
+        for column in columns:
+            value, old = result.get(column), previous.get(
+                result["size"], {}).get(column)
+            if value is None:
+                cell = "-"
+            else:
+                cell = formats.get(column, "{0:.3f}").format(value)
+            if value and old:
+                cell += " ({0:+.0%})".format(value / old - 1)
+            line += "{0:>18}".format(cell)
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": _commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "arguments": dict((name, getattr(args, name)) for name in
+                                  names),
+                "results": results
+            }, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser, [1000, 10000, 100000])
+    parser.add_argument("--edits", type=int, default=5)
+    parser.add_argument("--bundle", type=float, default=0.05)
+    parser.add_argument("--jobs", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    if args.size:
+        # running as a child process
+        print(json.dumps(measure(args)))
+        return
+
+    names = TREE + ["edits", "bundle", "jobs"]
+    report(args, names, run_sizes(__file__, args, names),
+           ["cold", "noop", "noop_stateless", "edit", "rss"],
+           {"rss": "{0}"})
+
+
+if __name__ == "__main__":
+    main()
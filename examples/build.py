@@ -6,10 +6,10 @@
 """
 from __future__ import absolute_import, unicode_literals, division
 
-import subprocess
+import multiprocessing
 import gulpless
 import logging
-import shutil
+import sys
 import re
 import os
 
@@ -19,6 +19,7 @@ TSC = "tsc"
 LESSC = "lessc"
 AUTOPREFIXER = "autoprefixer"
 IMAGEMIN = "imagemin"
+STRIP = "strip"
 
 
 if os.name != "posix":
@@ -29,7 +30,25 @@ if os.name != "posix":
     IMAGEMIN += ".cmd"
 
 
+# command lines of long-lived workers that speak the `gulpless.workers`
+# protocol (see `worker.py`); tools without one (or whose workers can't be
+# started) are started once per job instead
+WORKERS = {
+    UGLIFY: None,  # npm install -g uglify-js
+    TSC: None,  # npm install -g typescript
+    LESSC: None,  # npm install -g less
+    AUTOPREFIXER: None,  # npm install -g autoprefixer
+    STRIP: [sys.executable, os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "worker.py")]
+}
+for tool, worker in WORKERS.items():
+    gulpless.workers.register(tool, worker, multiprocessing.cpu_count(),
+                              fallback=lambda argv, command=worker or [tool]:
+                              command + argv)
+
+
 class JavascriptHandler(gulpless.TreeHandler):
+    optional = [".gz", ".map.gz"]
     include = re.compile("///.*?<reference\s+path=[\"\'](.*)[\"\']\s*/>", re.I)
 
     def __init__(self, patterns, ignore_patterns=None):
@@ -41,7 +60,7 @@ class JavascriptHandler(gulpless.TreeHandler):
 
         # concatenate and minify
         imports = set()
-        cmdline = [UGLIFY]
+        cmdline = []
         current = os.path.dirname(input_path)
 
         for line in open(input_path):
@@ -55,7 +74,7 @@ class JavascriptHandler(gulpless.TreeHandler):
                 else:
                     imports.add(path)
                     cmdline.append(path.replace(os.sep, "/"))
-        if len(cmdline) == 1:
+        if not cmdline:
             raise EnvironmentError("Nothing to build")
 
         cmdline += ["--source-map", smap,
@@ -63,21 +82,17 @@ class JavascriptHandler(gulpless.TreeHandler):
                     "--source-map-include-sources",
                     "--prefix", str(input_path.count(os.sep)),
                     "--compress", "warnings=false,drop_debugger=false",
-                    "--mangle"]
-        try:
-            if subprocess.call(cmdline, stdout=open(js, "wb")) != 0:
-                raise EnvironmentError("Non-zero exit code in "
-                                       "{0}".format(UGLIFY))
-        except EnvironmentError:
-            raise EnvironmentError("Unable to start {0}. Did you run `npm "
-                                   "install -g uglify-js` ?".format(UGLIFY))
+                    "--mangle",
+                    "--output", js]
+        self.run_tool(UGLIFY, cmdline)
 
         # gzip
-        gulpless.gzip(js, js_gz, 6)
-        gulpless.gzip(smap, smap_gz, 6)
+        gulpless.compress_all([(js, js_gz), (smap, smap_gz)])
 
 
 class TypescriptHandler(gulpless.TreeHandler):
+    optional = [".gz", ".map.gz"]
+
     def __init__(self, patterns, ignore_patterns=None):
         super(TypescriptHandler, self).__init__(patterns, ignore_patterns,
                                                 ["", ".gz", ".map", ".map.gz"])
@@ -89,41 +104,30 @@ class TypescriptHandler(gulpless.TreeHandler):
         js, js_gz, smap, smap_gz = output_paths
 
         # compile
-        cmdline = [TSC, input_path,
-                   "--out", js,
-                   "--sourcemap",
-                   "--sourceRoot", "."]
-        try:
-            if subprocess.call(cmdline) != 0:
-                raise EnvironmentError("Non-zero exit code in {0}".format(TSC))
-        except EnvironmentError:
-            raise EnvironmentError("Unable to start {0}. Did you run "
-                                   "`npm install -g typescript` ?".format(TSC))
+        self.run_tool(TSC, [input_path,
+                            "--out", js,
+                            "--sourcemap",
+                            "--sourceRoot", "."])
 
         # uglify
-        cmdline = [UGLIFY, js,
-                   "--in-source-map", smap,
-                   "--source-map", smap,
-                   "--source-map-url", os.path.basename(smap),
-                   "--source-map-include-sources",
-                   "--prefix", "relative",
-                   "--compress", "warnings=false,drop_debugger=false",
-                   "--mangle",
-                   "--output", js]
-        try:
-            if subprocess.call(cmdline) != 0:
-                raise EnvironmentError("Non-zero exit code in "
-                                       "{0}".format(UGLIFY))
-        except EnvironmentError:
-            raise EnvironmentError("Unable to run {0}. Did you run `npm "
-                                   "install -g uglify-js` ?".format(UGLIFY))
+        self.run_tool(UGLIFY, [js,
+                               "--in-source-map", smap,
+                               "--source-map", smap,
+                               "--source-map-url", os.path.basename(smap),
+                               "--source-map-include-sources",
+                               "--prefix", "relative",
+                               "--compress",
+                               "warnings=false,drop_debugger=false",
+                               "--mangle",
+                               "--output", js])
 
         # gzip
-        gulpless.gzip(js, js_gz, 6)
-        gulpless.gzip(smap, smap_gz, 6)
+        gulpless.compress_all([(js, js_gz), (smap, smap_gz)])
 
 
 class LessHandler(gulpless.TreeHandler):
+    optional = [".gz", ".map.gz"]
+
     def __init__(self, patterns, ignore_patterns=None):
         super(LessHandler, self).__init__(patterns, ignore_patterns,
                                           ["", ".gz", ".map", ".map.gz"])
@@ -135,50 +139,47 @@ class LessHandler(gulpless.TreeHandler):
         css, css_gz, smap, smap_gz = output_paths
 
         # compile
-        cmdline = [LESSC,
-                   "--source-map={0}".format(smap),
-                   "--source-map-url={0}".format(os.path.basename(smap)),
-                   "--source-map-less-inline",
-                   "--compress",
-                   input_path,
-                   css]
-        try:
-            if subprocess.call(cmdline) != 0:
-                raise EnvironmentError("Non-zero exit code in "
-                                       "{0}".format(LESSC))
-        except EnvironmentError:
-            raise EnvironmentError("Unable to start {0}. Did you run `npm "
-                                   "install -g less` ?".format(LESSC))
+        self.run_tool(LESSC, [
+            "--source-map={0}".format(smap),
+            "--source-map-url={0}".format(os.path.basename(smap)),
+            "--source-map-less-inline",
+            "--compress",
+            input_path,
+            css
+        ])
 
         # autoprefix
-        cmdline = [AUTOPREFIXER,
-                   css,
-                   "--map",
-                   "--no-cascade",
-                   "--output", css]
-        try:
-            if subprocess.call(cmdline) != 0:
-                raise EnvironmentError("Non-zero exit code in "
-                                       "{0}".format(AUTOPREFIXER))
-        except EnvironmentError:
-            raise EnvironmentError("Unable to start {0}. Did you run `npm "
-                                   "install -g autoprefixer` "
-                                   "?".format(AUTOPREFIXER))
+        self.run_tool(AUTOPREFIXER, [css,
+                                     "--map",
+                                     "--no-cascade",
+                                     "--output", css])
 
         # gzip
-        gulpless.gzip(css, css_gz, 6)
-        gulpless.gzip(smap, smap_gz, 6)
+        gulpless.compress_all([(css, css_gz), (smap, smap_gz)])
 
 
 class StaticHandler(gulpless.Handler):
+    optional = [".gz"]
+
     def __init__(self, patterns, ignore_patterns=None):
         super(StaticHandler, self).__init__(patterns, ignore_patterns,
                                             ["", ".gz"])
 
     def build(self, input_path, output_paths):
         output_path, gzip_path = output_paths
-        shutil.copy(input_path, output_path)
-        gulpless.gzip(input_path, gzip_path)
+        gulpless.materialize(input_path, output_path)
+        gulpless.compress(input_path, gzip_path)
+
+
+class TemplateHandler(gulpless.Handler):
+    def __init__(self, patterns, ignore_patterns=None):
+        super(TemplateHandler, self).__init__(patterns, ignore_patterns)
+
+    def build(self, input_path, output_paths):
+        output_path, = output_paths
+
+        # strip whitespace
+        self.run_tool(STRIP, [input_path, output_path])
 
 
 class ImageHandler(gulpless.Handler):
@@ -194,7 +195,8 @@ class ImageHandler(gulpless.Handler):
                    "--optimizationLevel", "3",
                    "--progressive"]
         try:
-            if subprocess.call(cmdline, stdout=open(output_path, "wb")) != 0:
+            if gulpless.cancel.call(cmdline,
+                                    stdout=open(output_path, "wb")) != 0:
                 raise EnvironmentError("Non-zero exit code in "
                                        "{0}".format(IMAGEMIN))
         except EnvironmentError:
@@ -209,5 +211,6 @@ HANDLERS = [
     TypescriptHandler(["js/*.ts"], ["js/*.d.ts"]),
     LessHandler(["css/*.less"], ["*bootstrap/*.less"]),
     StaticHandler(["fonts/*", "crossdomain.xml", "respond-*"]),
+    TemplateHandler(["templates/*.html"]),
     ImageHandler(["img/*"])
 ]
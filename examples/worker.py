@@ -0,0 +1,33 @@
+# coding=utf-8
+"""A minimal long-lived worker that speaks the `gulpless.workers` protocol. It
+strips the templates of `build.py`, and can stand in for a real tool while
+trying out worker pools:
+
+`gulpless.workers.register("strip", [sys.executable, "worker.py"])`
+
+When given the paths of an input and an output, it runs that single job and
+exits instead, like tools without a worker do.
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import gulpless.workers
+import sys
+import io
+
+
+def strip(job):
+    """Copies job[0] to job[1], dropping blank lines and indentation."""
+    input_path, output_path = job
+    with io.open(input_path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    with io.open(output_path, "w", encoding="utf-8") as f:
+        f.writelines(line + "\n" for line in lines if line)
+    return len(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        strip(sys.argv[1:])
+    else:
+        gulpless.workers.serve(strip)
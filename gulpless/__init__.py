@@ -2,10 +2,17 @@
 from __future__ import absolute_import, unicode_literals, division
 from gulpless.handlers import Handler, TreeHandler
 from gulpless.reactor import Reactor
+from gulpless.group import Group
+from gulpless.compress import compress, compress_all
+from gulpless.materialize import materialize
 from gulpless.helpers import gzip
+from gulpless import workers
+from gulpless import cancel
+from gulpless import trace
 
 
-__all__ = ["Handler", "TreeHandler", "Reactor", "gzip"]
+__all__ = ["Handler", "TreeHandler", "Reactor", "Group", "gzip", "compress",
+           "compress_all", "materialize", "workers", "cancel", "trace"]
 
 
 def main():
@@ -26,16 +33,49 @@ def main():
                         default=os.getcwd(),
                         help="Look for `build.py` in this folder (defaults to "
                              "the current directory)")
+    parser.add_argument("-j", "--jobs",
+                        action="store",
+                        type=int,
+                        default=1,
+                        help="Run up to this many builds at the same time "
+                             "(defaults to 1)")
+    parser.add_argument("--trace",
+                        action="store",
+                        metavar="FILE",
+                        help="Save a trace of everything that happened to "
+                             "this file, in the Chrome trace event format")
+    parser.add_argument("--stats",
+                        action="store_true",
+                        help="Print how much time was spent where before "
+                             "exiting")
+    parser.add_argument("-b", "--bind",
+                        action="store",
+                        default="localhost",
+                        help="Address that `serve` and `worker` listen on "
+                             "(defaults to localhost); `worker` also accepts "
+                             "the path of a Unix socket")
+    parser.add_argument("-p", "--port",
+                        action="store",
+                        type=int,
+                        default=8000,
+                        help="Port that `serve` and `worker` listen on "
+                             "(defaults to 8000)")
     parser.add_argument("mode",
                         action="store",
-                        choices=["build", "interactive"],
+                        choices=["build", "interactive", "serve", "worker"],
                         default="interactive",
                         metavar="mode",
                         nargs="?",
                         help="If `interactive` (the default), will wait for "
                              "filesystem events and attempt to keep the input "
                              "and output folders in sync. If `build`, it will "
-                             "attempt to build all updated files, then exit.")
+                             "attempt to build all updated files, then exit "
+                             "(with a non-zero status if any of them failed). "
+                             "If `serve`, it will also serve the output "
+                             "folder over HTTP, holding requests for files "
+                             "that are being built until they are done. If "
+                             "`worker`, it will run builds for the "
+                             "gulpless processes that list it in `REMOTE`.")
 
     args = parser.parse_args()
     os.chdir(args.directory)
@@ -64,7 +104,87 @@ def main():
         logging.basicConfig(level=logging.INFO,
                             format="%(message)s")
 
-    reactor = Reactor(build.SRC, build.DEST)
-    for handler in build.HANDLERS:
-        reactor.add_handler(handler)
-    reactor.run(args.mode == "build")
+    sink = None
+    if args.trace or args.stats:
+        trace.enable()
+        if args.trace:
+            sink = trace.ChromeTrace(args.trace)
+            trace.add_sink(sink)
+
+    # `ROOTS` is a list of dicts with the `src`, `dest` and `handlers` of
+    # every root, along with any other arguments of their `Reactor`
+    roots = getattr(build, "ROOTS", None) or [
+        {"src": build.SRC, "dest": build.DEST, "handlers": build.HANDLERS}
+    ]
+    if args.mode == "worker":
+        from gulpless.remote import listen
+        if "/" in args.bind or os.sep in args.bind:
+            address, where = args.bind, args.bind
+        else:
+            address = (args.bind, args.port)
+            where = "{0}:{1}".format(args.bind, args.port)
+        server = listen(address, [handler for root in roots
+                                  for handler in root["handlers"]], args.jobs)
+        logging.info("Waiting for jobs on {0}".format(where))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        workers.close()
+        succeeded = True
+    else:
+        succeeded = _run(build, roots, args)
+
+    if sink is not None:
+        sink.close()
+    if args.stats:
+        print(trace.summary())
+    if not succeeded:
+        sys.exit(1)
+
+
+def _run(build, roots, args):
+    """Keeps the output folders of `roots` in sync, as asked by `args`.
+    Returns whether everything was built successfully."""
+    import sys
+
+    executor = None
+    if getattr(build, "REMOTE", None):
+        from gulpless.remote import RemoteExecutor
+        executor = RemoteExecutor(build.REMOTE)
+
+    state = getattr(build, "STATE", ".gulpless")
+    group = Group(args.jobs, cache=getattr(build, "CACHE", None))
+    for i, root in enumerate(roots):
+        root = dict(root)
+        if "state" not in root:
+            root["state"] = state if len(roots) == 1 or not state else \
+                "{0}.{1}".format(state, i)
+        if executor is not None:
+            root.setdefault("executor", executor)
+        group.add(root.pop("src"), root.pop("dest"), root.pop("handlers"),
+                  **root)
+
+    succeeded = True
+    if args.mode == "build":
+        # a single scan and batch in this thread; nothing is watched
+        try:
+            succeeded = group.build()
+        except KeyboardInterrupt:
+            succeeded = False
+    else:
+        server = None
+        if args.mode == "serve":
+            if len(group.reactors) > 1:
+                sys.exit("Only a single root can be served.")
+            from gulpless.server import serve
+            server = serve(group.reactors[0], (args.bind, args.port))
+        group.run()
+
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    if executor is not None:
+        executor.close()
+    return succeeded
@@ -0,0 +1,185 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.materialize import materialize
+from gulpless import trace
+
+import threading
+import termcolor
+import tempfile
+import logging
+import hashlib
+import shutil
+import json
+import time
+import os
+
+
+__all__ = ["BuildCache"]
+
+
+class BuildCache(object):
+    def __init__(self, path, max_size=1 << 30, strategies=None):
+        """Creates a cache of build outputs in the folder `path`, keyed by
+        the contents of the inputs that produced them (see `key`). Once the
+        cached outputs take up more than `max_size` bytes, the least recently
+        used ones are evicted. Entries are copied in and out of the cache with
+        `gulpless.materialize` using `strategies`; hardlinks should only be
+        used if no tool ever modifies its outputs in place. Several reactors
+        (or processes) may share the same cache folder."""
+        super(BuildCache, self).__init__()
+
+        self.path = path
+        self.max_size = max_size
+        self.strategies = strategies
+
+        self.hits = self.misses = self.stores = 0
+        self._lock = threading.Lock()
+        self._entries = None  # maps keys to their size and last use
+
+    @staticmethod
+    def key(*parts):
+        """Returns a cache key for the JSON-serializable `parts`."""
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode(
+            "utf-8")).hexdigest()
+
+    def restore(self, key, output_paths):
+        """Restores the outputs cached under `key` to `output_paths`,
+        returning whether it was a hit. Outputs that weren't produced by the
+        cached build are deleted."""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "manifest"), "rb") as f:
+                manifest = json.loads(f.read().decode("utf-8"))
+            if manifest["outputs"] != len(output_paths):
+                raise ValueError("Mismatched outputs")
+
+            for i, output in enumerate(output_paths):
+                if i in manifest["present"]:
+                    materialize(os.path.join(entry, str(i)), output,
+                                self.strategies)
+                    # restored outputs must be newer than their inputs
+                    os.utime(output, None)
+                elif os.path.exists(output):
+                    os.unlink(output)
+            os.utime(entry, None)
+        except (EnvironmentError, KeyError, TypeError, ValueError):
+            with self._lock:
+                self.misses += 1
+            trace.count("cache misses")
+            return False
+
+        with self._lock:
+            self.hits += 1
+            if self._entries is not None and key in self._entries:
+                self._entries[key][1] = time.time()
+        trace.count("cache hits")
+        return True
+
+    def store(self, key, output_paths):
+        """Saves copies of the existing `output_paths` under `key`."""
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+
+        # entries are assembled in a temporary folder and renamed into place,
+        # so other processes never see partially written ones
+        folder = os.path.dirname(entry)
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        except EnvironmentError:
+            # created by another process in the mean time
+            pass
+        temp = tempfile.mkdtemp(prefix=".tmp-", dir=folder)
+        try:
+            present, size = [], 0
+            for i, output in enumerate(output_paths):
+                if os.path.exists(output):
+                    materialize(output, os.path.join(temp, str(i)),
+                                self.strategies)
+                    present.append(i)
+                    size += os.path.getsize(output)
+            with open(os.path.join(temp, "manifest"), "wb") as f:
+                f.write(json.dumps({
+                    "outputs": len(output_paths),
+                    "present": present,
+                    "size": size
+                }).encode("utf-8"))
+            os.rename(temp, entry)
+        except EnvironmentError as e:
+            shutil.rmtree(temp, ignore_errors=True)
+            if not os.path.exists(entry):
+                logging.warning("Unable to cache outputs in '{0}': "
+                                "{1}".format(entry, e))
+            return
+
+        with self._lock:
+            self.stores += 1
+            if self._entries is not None:
+                self._entries[key] = [size, time.time()]
+        self._evict()
+
+    def flush(self):
+        """Logs the hits and misses since the last call."""
+        with self._lock:
+            hits, misses, stores = self.hits, self.misses, self.stores
+            self.hits = self.misses = self.stores = 0
+        if hits or misses:
+            logging.info("Build cache: {0} hits, {1} misses, {2} "
+                         "stored".format(
+                             termcolor.colored(hits, "green",
+                                               attrs=["bold"]),
+                             misses, stores))
+
+    def _entry(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def _load(self):
+        # maps every entry in the cache folder to its [size, last use]
+        entries = {}
+        if os.path.isdir(self.path):
+            for prefix in os.listdir(self.path):
+                folder = os.path.join(self.path, prefix)
+                if len(prefix) != 2 or not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    if name.startswith("."):
+                        continue
+                    entry = os.path.join(folder, name)
+                    try:
+                        with open(os.path.join(entry, "manifest"), "rb") as f:
+                            size = json.loads(f.read().decode("utf-8"))["size"]
+                        entries[prefix + name] = [size, os.path.getmtime(
+                            entry)]
+                    except (EnvironmentError, KeyError, TypeError,
+                            ValueError):
+                        continue
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            total = sum(size for size, used in self._entries.values())
+            if total <= self.max_size:
+                return
+
+            evicted = []
+            for key, (size, used) in sorted(self._entries.items(),
+                                            key=lambda item: item[1][1]):
+                if total <= self.max_size:
+                    break
+                total -= size
+                evicted.append(key)
+                del self._entries[key]
+
+        for key in evicted:
+            # rename first, so that the entry disappears all at once
+            entry = self._entry(key)
+            folder, name = os.path.split(entry)
+            trash = os.path.join(folder, ".del-" + name)
+            try:
+                os.rename(entry, trash)
+            except EnvironmentError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""Cancellation of running builds. The reactor runs every build with a
+`Token` that it cancels as soon as the inputs of the build change again, so
+that the build can stop early instead of finishing an obsolete version.
+
+Builds don't need to do anything to be cancelled: subprocesses started with
+`call` (or by `gulpless.workers`) are killed, and whatever the build raises
+(or returns) afterwards is ignored. Builds that spend a long time in Python
+code may call `check` every now and then.
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import contextlib
+import subprocess
+import threading
+
+
+__all__ = ["Cancelled", "Token", "scope", "current", "cancelled", "check",
+           "watch", "call"]
+
+
+class Cancelled(Exception):
+    """Raised by `check` when the current build was cancelled."""
+
+
+class Token(object):
+    def __init__(self):
+        """Tells a build whether it was cancelled, and calls the functions
+        that were registered with `register` when it is."""
+        super(Token, self).__init__()
+
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        """Cancels the build; only the first call has any effect."""
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback):
+        """Calls `callback` once the token is cancelled, or right away if it
+        already was. Returns a function that unregisters it."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def scope(token):
+    """Makes `token` the current token of the calling thread within the
+    `with` block."""
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def current():
+    """Returns the token of the build that runs in the calling thread, or None
+    if there is none."""
+    return getattr(_local, "token", None)
+
+
+def cancelled():
+    """Returns whether the build that runs in the calling thread was
+    cancelled."""
+    token = current()
+    return token is not None and token.cancelled
+
+
+def check():
+    """Raises `Cancelled` if the build that runs in the calling thread was
+    cancelled."""
+    if cancelled():
+        raise Cancelled()
+
+
+@contextlib.contextmanager
+def watch(callback):
+    """Calls `callback` if the current build is cancelled while the `with`
+    block runs (e.g. to kill the process it waits for)."""
+    token = current()
+    unregister = token.register(callback) if token is not None else None
+    try:
+        yield
+    finally:
+        if unregister is not None:
+            unregister()
+
+
+def call(cmdline, **kwargs):
+    """Like `subprocess.call`, but the process is killed and `Cancelled` is
+    raised if the current build is cancelled while it runs."""
+    process = subprocess.Popen(cmdline, **kwargs)
+    with watch(lambda: _kill(process)):
+        code = process.wait()
+    check()
+    return code
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except EnvironmentError:
+        # it already exited
+        pass
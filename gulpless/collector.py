@@ -1,61 +1,294 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, division
+from gulpless.scheduler import Scheduler
 from gulpless.proxy import Proxy
+from gulpless import trace
 
 import threading
-import datetime
+import logging
+import time
 
 
-class Collector(threading.Thread):
-    def __init__(self, observer, src_path, dest_path, bundle, timeout, batch):
-        super(Collector, self).__init__()
-
-        self.src_proxy = Proxy(observer, src_path, self.on_change)
-        self.dest_proxy = Proxy(observer, dest_path, self.on_change)
-
-        self.bundle = datetime.timedelta(seconds=bundle)
-        self.timeout = datetime.timedelta(seconds=timeout)
-        self.batch = batch
+class Detector(threading.Thread):
+    def __init__(self, jobs=4):
+        """Runs the detection loop of several `Collector`s in a single thread,
+        collecting the changes of each one of them once their FS events stop
+        arriving. All of their trees are checked on the same timer (the
+        shortest `timeout` of the collectors), so that their periodic full
+        rescans happen in a single pass, and the top level folders of all of
+        them are scanned by a single scheduler of up to `jobs` threads (see
+        `gulpless.scanner.Scanner`), which is stopped along with it."""
+        super(Detector, self).__init__()
 
+        self.scheduler = Scheduler(jobs)
         self.running = True
         self.lock = threading.Condition()
-        self.wakeup = datetime.datetime.now()
+        self.timeout = None  # how often the trees are checked
+        self.wakeup = time.time()  # when all trees must be checked again
+
+        self._collectors = []
+
+    def add(self, collector):
+        with self.lock:
+            self._collectors.append(collector)
+            self.timeout = min(collector.timeout for collector in
+                               self._collectors)
+            self.lock.notify_all()
+
+    def remove(self, collector):
+        with self.lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
 
-    def timedelta(self):
-        now = datetime.datetime.now()
-        td = self.wakeup - now
-        micro = td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6
-        return now, micro / 10**6
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.scheduler.stop()
 
     def run(self):
-        while self.running:
+        while True:
             with self.lock:
-                # wait until `wakeup` is in the past or we died
+                # wait until it's time to collect changes or we died
                 while self.running:
-                    now, delta = self.timedelta()
-                    if delta > 0:
-                        self.lock.wait(delta)
-                    else:
+                    if not self._collectors:
+                        self.lock.wait()
+                        continue
+                    now = time.time()
+                    tick = now >= self.wakeup
+                    if tick:
                         self.wakeup = now + self.timeout
+                    due = [collector for collector in self._collectors
+                           if collector._due(now, tick)]
+                    if due:
                         break
+                    self.lock.wait(min([self.wakeup] + [
+                        collector._next() for collector in self._collectors
+                        if collector._first is not None]) - now)
+
+                if not self.running:
+                    break
+
+            for collector in due:
+                collector._collect(now)
+
+
+class Collector(object):
+    def __init__(self, src_path, dest_path, bundle, timeout, batch,
+                 rescan=30, max_delay=None, interrupt=None, detector=None):
+        """Collects the changes to both folders and passes them to `batch`.
+        Changes are only collected once FS events stop arriving for a while;
+        that window adapts to the rate of the events, between `bundle` / 10
+        and `bundle` seconds, but changes are never held back for more than
+        `max_delay` seconds (10 * `bundle` by default). Batches run in a
+        separate thread, so the changes that are made in the mean time are
+        collected (and merged into a single batch) while they run. If
+        `interrupt` is not None, it is called with the source paths that were
+        updated or deleted as soon as they are collected, so that the running
+        batch may cancel the builds they make obsolete. If `detector` is not
+        None, it is shared with other collectors (see `Detector`) and its
+        owner starts and stops it."""
+        super(Collector, self).__init__()
+
+        self._detector = detector or Detector()
+        self._own_detector = detector is None
+        self.src_proxy = Proxy(src_path, self.on_change, rescan,
+                               self._detector.scheduler)
+        self.dest_proxy = Proxy(dest_path, self.on_change, rescan,
+                                self._detector.scheduler)
+
+        self.bundle = bundle
+        self.max_delay = max_delay if max_delay is not None else 10 * bundle
+        self.timeout = min(timeout, rescan)
+        self.batch = batch
+        self.interrupt = interrupt
+
+        self.running = True
+        self.lock = self._detector.lock
+
+        self.files = None  # (src, dest) files as of the current batch
+        self.scanned = None  # when the scan of `files` started
+        self.collecting = False  # whether changes are being collected
+        self.collected = 0  # how many times source changes were collected
+        self.current = 0  # the value of `collected` as of the current batch
+        self.changes = {}  # the source changes of the current batch
+        self.staleness = None  # how long the last batch waited to start
+        self.latency = None  # how long after its first change it completed
+
+        self._first = None  # when the first uncollected event occurred
+        self._last = None  # when the last event occurred
+        self._gap = None  # the average time between events
+        self._pending = None  # changes that wait for a batch to run them
+        self._batches = 0  # the number of batches that were started
+        self._runner = threading.Thread(target=self._run_batches)
+        self._runner.daemon = True
 
-                if not self.src_proxy.updated and not self.dest_proxy.updated:
-                    # no changes to be applied; do nothing
-                    continue
+    def watch(self, observer):
+        """Watches both folders for FS events using `observer`."""
+        self.src_proxy.watch(observer)
+        self.dest_proxy.watch(observer)
 
-            # collect events
+    def start(self):
+        self._detector.add(self)
+        if self._own_detector:
+            self._detector.start()
+        self._runner.start()
+
+    def is_alive(self):
+        return self._runner.is_alive() or \
+            self._own_detector and self._detector.is_alive()
+
+    def join(self, timeout=None):
+        if self._own_detector and self._detector.is_alive():
+            self._detector.join(timeout)
+        if self._runner.is_alive():
+            self._runner.join(timeout)
+
+    def _due(self, now, tick):
+        """Whether changes should be collected `now`; `tick` is whether the
+        detector's timer went off. Must be called with the lock held."""
+        if self._first is None:
+            return tick
+        return self._next() <= now
+
+    def _collect(self, now):
+        with self.lock:
+            if not self.running:
+                return
+            if not any(proxy.updated or proxy.due for proxy in
+                       (self.src_proxy, self.dest_proxy)):
+                # no changes to be applied; do nothing
+                self._first = None
+                return
+            first, self._first = self._first or now, None
+            self.collecting = True
+
+        # collect events
+        scanned = time.time()
+        with trace.span("collect"):
+            src_updated, src_deleted = self.src_proxy.changes()
+            dest_updated, dest_deleted = self.dest_proxy.changes()
+            files = self.src_proxy.files, self.dest_proxy.files
+
+        if self.interrupt is not None and (src_updated or src_deleted):
+            self.interrupt(src_updated + src_deleted)
+
+        with self.lock:
+            self.collecting = False
+            if src_updated or src_deleted:
+                self.collected += 1
+            if self._pending is None:
+                if self._batches and not (src_updated or src_deleted or
+                                          dest_updated or dest_deleted):
+                    # nothing changed since the last batch
+                    return
+                self._pending = first, {}, {}, files, scanned
+            self._pending = (min(first, self._pending[0]),
+                             _merge(self._pending[1], src_updated,
+                                    src_deleted),
+                             _merge(self._pending[2], dest_updated,
+                                    dest_deleted),
+                             files, scanned)
+            self.lock.notify_all()
+
+    def collect(self):
+        """Scans both folders once and runs a batch with their changes in the
+        calling thread, without starting the collector; for one-shot
+        builds."""
+        scanned = time.time()
+        with trace.span("collect"):
             src_updated, src_deleted = self.src_proxy.changes()
             dest_updated, dest_deleted = self.dest_proxy.changes()
+            files = self.src_proxy.files, self.dest_proxy.files
 
-            # process current batch while blocking this thread
-            self.batch(src_updated, src_deleted, dest_updated, dest_deleted)
+        self.files, self.scanned = files, scanned
+        self._batches += 1
+        self.batch(src_updated, src_deleted, dest_updated, dest_deleted)
+        trace.count("batches")
 
     def stop(self):
         with self.lock:
             self.running = False
-            self.lock.notify()
+            self.lock.notify_all()
+        self._detector.remove(self)
+        if self._own_detector:
+            self._detector.stop()
+
+    def pending(self, dispatched):
+        """Returns the source paths that were changed but not dispatched yet,
+        or None while changes are being collected (and aren't known yet).
+        `dispatched` is the value of `current` as of the last batch that
+        dispatched its changes."""
+        with self.lock:
+            if self.collecting:
+                return None
+            paths = self.src_proxy.pending()
+            if self._pending is not None:
+                paths.extend(self._pending[1])
+            if dispatched < self.current:
+                paths.extend(self.changes)
+            return paths
 
     def on_change(self):
         with self.lock:
-            self.wakeup = datetime.datetime.now() + self.bundle
-            self.lock.notify()
+            now = time.time()
+            if self._last is not None:
+                # gaps longer than `bundle` don't tell anything about bursts
+                gap = min(now - self._last, self.bundle)
+                self._gap = gap if self._gap is None else \
+                    0.7 * self._gap + 0.3 * gap
+            self._last = now
+            if self._first is None:
+                self._first = now
+            self.lock.notify_all()
+
+    def _next(self):
+        """Returns when the changes that events were seen for should be
+        collected."""
+        # wait until events have stopped for twice their usual interval
+        window = self.bundle if self._gap is None else 2 * self._gap
+        window = min(max(window, self.bundle / 10), self.bundle)
+        return min(self._last + window, self._first + self.max_delay)
+
+    def _run_batches(self):
+        while True:
+            with self.lock:
+                while self.running and self._pending is None:
+                    self.lock.wait()
+                if not self.running:
+                    break
+                (first, src, dest, files, scanned), self._pending = \
+                    self._pending, None
+                self._batches += 1
+                self.current = self.collected
+                self.changes = src
+
+            # the proxies may already know about changes that the batch won't
+            # deal with; those must not be saved as part of the build state
+            self.files, self.scanned = files, scanned
+
+            start = time.time()
+            self.batch(*(_split(src) + _split(dest)))
+            end = time.time()
+
+            self.staleness, self.latency = start - first, end - first
+            trace.count("batches")
+            trace.count("batch staleness (s)", self.staleness)
+            logging.debug("Batch started {0:.2f}s and completed {1:.2f}s "
+                          "after the first change".format(self.staleness,
+                                                          self.latency))
+
+
+def _merge(changes, updated, deleted):
+    """Merges a scan's changes into a dict that maps paths to whether they
+    were updated (True) or deleted (False); later scans win."""
+    for path in deleted:
+        changes[path] = False
+    for path in updated:
+        changes[path] = True
+    return changes
+
+
+def _split(changes):
+    return ([path for path, updated in changes.items() if updated],
+            [path for path, updated in changes.items() if not updated])
@@ -0,0 +1,113 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.helpers import atomic_replace
+from gulpless.scheduler import Scheduler
+
+import tempfile
+import zlib
+import os
+
+try:
+    from os import cpu_count
+except ImportError:
+    from multiprocessing import cpu_count
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+__all__ = ["ENCODINGS", "compress", "compress_all"]
+
+
+# maps an encoding to its file extension and a function that returns a new
+# compressor for a given level
+ENCODINGS = {
+    "gzip": (".gz", lambda level: zlib.compressobj(level, zlib.DEFLATED,
+                                                   16 + zlib.MAX_WBITS)),
+    "deflate": (".zz", lambda level: zlib.compressobj(level))
+}
+if bz2:
+    ENCODINGS["bz2"] = (".bz2", lambda level: bz2.BZ2Compressor(level))
+if lzma:
+    ENCODINGS["xz"] = (".xz", lambda level: lzma.LZMACompressor(
+        preset=level))
+
+CHUNK_SIZE = 1 << 20
+
+_scheduler = Scheduler(cpu_count() or 1)
+
+
+def compress(original, compressed, encoding="gzip", level=6):
+    """Compresses `original` into `compressed` using one of the `ENCODINGS`.
+    If the result would not be smaller than the original, `compressed` is
+    not written (any previous version is removed instead) and False is
+    returned. The file is read in large chunks; since the compressors release
+    the GIL, several files may be compressed by different threads at the same
+    time."""
+    try:
+        compressor = ENCODINGS[encoding][1](level)
+    except KeyError:
+        raise ValueError("Unknown encoding '{0}'".format(encoding))
+
+    folder, name = os.path.split(os.path.abspath(compressed))
+    fd, temp = tempfile.mkstemp(prefix=name + ".", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as out, open(original, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            buf = bytearray(min(CHUNK_SIZE, max(size, 1)))
+            view = memoryview(buf)
+
+            # stop as soon as the output is larger than the input
+            written = 0
+            while written < size:
+                count = f.readinto(buf)
+                if count:
+                    data = compressor.compress(view[:count])
+                else:
+                    data = compressor.flush()
+                written += len(data)
+                out.write(data)
+                if not count:
+                    break
+
+        if written < size:
+            atomic_replace(temp, compressed)
+            return True
+    except Exception:
+        os.unlink(temp)
+        raise
+
+    os.unlink(temp)
+    if os.path.exists(compressed):
+        os.unlink(compressed)
+    return False
+
+
+def compress_all(files, encoding="gzip", level=6):
+    """Compresses every (original, compressed) tuple in `files` in parallel,
+    returning a list of results as described in `compress`. If any of them
+    fails, the first error is raised after all of them completed."""
+    files = list(files)
+    results = [None] * len(files)
+    errors = []
+
+    def task(i, original, compressed):
+        def run():
+            try:
+                results[i] = compress(original, compressed, encoding, level)
+            except Exception as e:
+                errors.append(e)
+        return run
+
+    _scheduler.run(task(i, original, compressed) for i, (original, compressed)
+                   in enumerate(files))
+    if errors:
+        raise errors[0]
+    return results
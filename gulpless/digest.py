@@ -0,0 +1,80 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+
+import hashlib
+import os
+
+
+__all__ = ["DigestCache", "cache", "digest", "combine"]
+
+
+class DigestCache(object):
+    def __init__(self, chunk_size=1 << 20):
+        """Creates a new cache of file digests. Entries are keyed by the file's
+        inode, size and modification time (in nanoseconds), so unchanged files
+        are never read twice."""
+        super(DigestCache, self).__init__()
+
+        self.chunk_size = chunk_size
+        self.entries = {}  # maps a filename to (inode, size, mtime_ns, digest)
+
+    def digest(self, filename):
+        """Returns the hex digest of `filename`'s contents."""
+        stat = os.stat(filename)
+        key = stat.st_ino, stat.st_size, _mtime_ns(stat)
+
+        entry = self.entries.get(filename)
+        if entry is not None and tuple(entry[:3]) == key:
+            return entry[3]
+
+        result = hashlib.sha1()
+        with open(filename, "rb") as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                result.update(chunk)
+        result = result.hexdigest()
+
+        self.entries[filename] = key + (result,)
+        return result
+
+    def dump(self, folder=None):
+        """Returns the cache's entries in a JSON-serializable format; only the
+        ones of files in `folder`, if it's not None."""
+        prefix = None if folder is None else os.path.join(folder, "")
+        # other threads may add entries in the mean time
+        return dict((filename, list(entry)) for filename, entry in
+                    dict(self.entries).items()
+                    if prefix is None or filename.startswith(prefix))
+
+    def load(self, entries):
+        """Adds the entries returned by `dump` to the cache; if any of them
+        is invalid, none are."""
+        self.entries.update(dict((filename, (int(ino), int(size), int(mtime),
+                                             str(value)))
+                                 for filename, (ino, size, mtime, value) in
+                                 entries.items()))
+
+
+def _mtime_ns(stat):
+    try:
+        return stat.st_mtime_ns
+    except AttributeError:
+        return int(stat.st_mtime * 10**9)
+
+
+cache = DigestCache()
+
+
+def digest(filename):
+    """Returns the hex digest of `filename` using the shared cache."""
+    return cache.digest(filename)
+
+
+def combine(digests):
+    """Returns a single digest of a list of (name, digest) pairs."""
+    result = hashlib.sha1()
+    for name, value in sorted(digests):
+        result.update("{0}\0{1}\0".format(name, value).encode("utf-8"))
+    return result.hexdigest()
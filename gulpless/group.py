@@ -0,0 +1,112 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.scheduler import Scheduler
+from gulpless.collector import Detector
+from gulpless.cache import BuildCache
+from gulpless.proxy import Observer
+from gulpless.reactor import Reactor
+from gulpless import workers
+
+import threading
+import time
+
+
+class Group(object):
+    def __init__(self, jobs=1, cache=None):
+        """Runs several reactors in a single process. They share a single
+        observer, a single `gulpless.collector.Detector` that collects the
+        changes of all of them (and rescans all of their folders at once),
+        and a single scheduler that runs at most `jobs` builds at the same
+        time out of all of their batches, so that the builds of every root
+        are ordered by the same priorities. `cache` may be a
+        `gulpless.cache.BuildCache` (or the name of its folder) that is shared
+        by all of them."""
+        super(Group, self).__init__()
+
+        if cache is not None and not isinstance(cache, BuildCache):
+            cache = BuildCache(cache)
+        self._cache = cache
+
+        self._observer = Observer()
+        self._detector = Detector()
+        self._scheduler = Scheduler(jobs, counter="queue wait (s)")
+        self.reactors = []
+        self.running = False
+
+    def add(self, src_path, dest_path, handlers=(), **kwargs):
+        """Creates a reactor that keeps `dest_path` in sync with `src_path`
+        using `handlers`, and returns it. Any other arguments are passed on to
+        `Reactor`."""
+        kwargs.setdefault("cache", self._cache)
+        reactor = Reactor(src_path, dest_path, observer=self._observer,
+                          scheduler=self._scheduler, detector=self._detector,
+                          **kwargs)
+        for handler in handlers:
+            reactor.add_handler(handler)
+        self.reactors.append(reactor)
+        return reactor
+
+    def start(self):
+        for reactor in self.reactors:
+            reactor.start()
+        self._observer.start()
+        self._detector.start()
+        self.running = True
+
+    def stop(self):
+        self._observer.stop()
+        for reactor in self.reactors:
+            reactor.stop()
+        self._detector.stop()
+        self._scheduler.stop()
+        workers.close()
+        self.running = False
+
+    def join(self, timeout=None):
+        self._observer.join()
+        if self._detector.is_alive():
+            self._detector.join()
+        for reactor in self.reactors:
+            reactor.join()
+
+    def run(self, once=False):
+        """Runs every reactor in the main thread; if `once` is true, returns
+        as soon as all of them have completed their first batch."""
+        for reactor in self.reactors:
+            reactor._once = once
+        self.start()
+        while self.running:
+            try:
+                time.sleep(1.0)
+                if not any(reactor.running for reactor in self.reactors):
+                    # they either failed or were run once
+                    self.stop()
+                    self.join()
+            except KeyboardInterrupt:
+                self.stop()
+                self.join()
+
+    def build(self):
+        """Brings the output folder of every reactor up to date once, without
+        watching anything (see `Reactor.build`); the first one is built in
+        the calling thread, the others in threads of their own. Returns
+        whether all of them succeeded."""
+        results = [False] * len(self.reactors)
+
+        def build(i):
+            results[i] = self.reactors[i].build()
+
+        threads = [threading.Thread(target=build, args=(i,)) for i in
+                   range(1, len(self.reactors))]
+        for thread in threads:
+            thread.start()
+        try:
+            if self.reactors:
+                build(0)
+        finally:
+            for thread in threads:
+                thread.join()
+            self._detector.stop()
+            self._scheduler.stop()
+            workers.close()
+        return all(results)
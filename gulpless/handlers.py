@@ -1,10 +1,19 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, division
+from gulpless import patterns as _patterns
+from gulpless.materialize import materialize
+from gulpless.helpers import atomic_write
+from gulpless import workers as _workers
+from gulpless import digest as _digest
+from gulpless import paths as _paths
+from gulpless import snapshot as _snapshot
+from gulpless import cancel
+from gulpless import trace
 
-import pathtools.patterns
 import termcolor
 import logging
-import shutil
+import json
+import mmap
 import time
 import re
 import os
@@ -19,12 +28,42 @@ class TimedSet(set):
 
 
 class Handler(object):
-    def __init__(self, patterns, ignore_patterns=None, suffixes=[""]):
+    # if not None, a function that is called with every path that does not
+    # match `patterns`, and returns whether it should be handled nonetheless
+    claims = None
+
+    # suffixes of outputs that `build` may decide not to produce (e.g.
+    # compressed files that would not be any smaller); missing ones don't
+    # cause the input to be rebuilt
+    optional = ()
+
+    # if not None, a function that is called with a list of (input_path,
+    # output_paths) tuples to build all of them at once, instead of calling
+    # `build` for each one of them (see `_build_many`)
+    build_many = None
+
+    # the `gulpless.materialize` strategies that the default `build` uses to
+    # copy inputs, or None for the default ones
+    strategies = None
+
+    # identifies the version of the tools used by `build`; builds are only
+    # restored from the build cache if it didn't change
+    version = None
+
+    # how many seconds worth of head start builds of this handler get in the
+    # build queue (see `gulpless.scheduler.Scheduler`); may be negative
+    priority = 0
+
+    def __init__(self, patterns, ignore_patterns=None, suffixes=[""],
+                 digest=False):
         """Creates a new handler. `patterns` and `ignore_patterns` are lists of
-        glob patterns that determine what files this handler operates on.
-        `suffixes` is a list of extensions that will be added to a input file
-        to produce output files (the files will be produced in the output
-        folder, but will respect the input folder structure)."""
+        glob patterns that determine what files this handler operates on (see
+        `gulpless.patterns.translate` for the supported syntax). `suffixes` is
+        a list of extensions that will be added to a input file to produce
+        output files (the files will be produced in the output folder, but
+        will respect the input folder structure). If `digest` is true, inputs
+        that are newer than their outputs are only rebuilt if their contents
+        actually changed since the last successful build."""
         super(Handler, self).__init__()
 
         self.patterns = [os.path.normcase(pattern) for pattern in patterns]
@@ -33,9 +72,21 @@ class Handler(object):
         if ignore_patterns:
             self.ignore_patterns = [os.path.normcase(pattern) for
                                     pattern in ignore_patterns]
+            common = set(self.patterns) & set(self.ignore_patterns)
+            if common:
+                raise ValueError("Conflicting patterns {0} included and "
+                                 "excluded".format(sorted(common)))
+
+        self._include = _patterns.compile(self.patterns)
+        self._exclude = _patterns.compile(self.ignore_patterns)
 
         self.suffixes = suffixes
         self.failures = {}
+        self.errors = {}  # files that could not be handled, and when
+        self.digest = digest
+        self.digests = {}  # maps inputs to the digest of their last build
+        self.build_cache = None  # a `gulpless.cache.BuildCache`, if any
+        self.executor = None  # a `gulpless.remote.RemoteExecutor`, if any
 
     def handles(self, src, path):
         """Must return a list of files that this handler will produce after
@@ -46,38 +97,210 @@ class Handler(object):
         the file identified by `path` changes (only the modification time is
         taken into account; `src` is provided for convenience; it allows direct
         access to the file's contents.."""
-        if not pathtools.patterns.match_path(path, self.patterns,
-                                             self.ignore_patterns):
+        if not self.matches(path):
             return None
 
         return self._outputs(src, path)
 
+    def matches(self, path):
+        """Returns whether `path` matches `patterns` but not
+        `ignore_patterns`."""
+        return \
+            self._include.match(path) is not None and \
+            self._exclude.match(path) is None
+
     def deleted(self, src, path):
         """Called whenever `path` is deleted from the source folder `src`."""
 
-    def changed(self, src, path, dest):
-        """Called whenever `path` is changed in the source folder `src`. `dest`
-        is the output folder. The default implementation calls `build` after
-        determining that the input file is newer than any of the outputs, or
-        any of the outputs does not exist."""
+    def flush(self):
+        """Called at the end of every batch; should save anything that needs
+        to survive a restart and isn't part of `dump_state`."""
+
+    def targets(self, src, path):
+        """Returns a dict that maps every file that should be built because
+        `path` was changed in the source folder `src` to its effective
+        modification time. The default implementation only returns `path`
+        itself. The reactor calls this to collect the builds of a batch so it
+        can run them in parallel without building the same file twice."""
         try:
-            mtime = os.path.getmtime(os.path.join(src, path))
-            self._build(src, path, dest, mtime)
+            targets = {path: _snapshot.getmtime(os.path.join(src, path))}
         except EnvironmentError as e:
             logging.error("{0} is inaccessible: {1}".format(
                 termcolor.colored(path, "yellow", attrs=["bold"]),
                 e.args[0]
             ))
+            self.errors[path] = time.time()
+            return {}
+        self.errors.pop(path, None)
+        return targets
+
+    def changed(self, src, path, dest):
+        """Called whenever `path` is changed in the source folder `src`. `dest`
+        is the output folder. The default implementation calls `build` for
+        every file returned by `targets` after determining that the input file
+        is newer than any of the outputs, or any of the outputs does not
+        exist. If the handler implements `build_many`, all of the targets are
+        built at once."""
+        targets = self.targets(src, path)
+        if self.build_many is not None:
+            self._build_many(src, targets, dest)
+            return
+        for target, mtime in targets.items():
+            self._build(src, target, dest, mtime)
+
+    def dump_state(self):
+        """Returns a JSON-serializable object describing everything this
+        handler knows about the source folder. It is saved at the end of every
+        batch and passed to `load_state` when the reactor is restarted."""
+        return {"failures": self.failures, "errors": self.errors,
+                "digests": self.digests}
+
+    def load_state(self, state):
+        """Restores the state returned by a previous call to `dump_state`."""
+        failures = dict((path, float(mtime)) for path, mtime in
+                        state["failures"].items())
+        errors = dict((path, float(when)) for path, when in
+                      state["errors"].items())
+        self.digests = dict((path, str(value)) for path, value in
+                            state["digests"].items())
+        self.failures, self.errors = failures, errors
+
+    def _signature(self):
+        """Returns a JSON-serializable object that changes whenever this
+        handler is configured to produce different outputs. Any saved state is
+        discarded if the signature doesn't match."""
+        cls = type(self)
+        return ["{0}.{1}".format(cls.__module__, cls.__name__),
+                self.patterns, self.ignore_patterns, self.suffixes]
 
     def _outputs(self, src, path):
         return [path + suffix for suffix in self.suffixes]
 
+    def _sources(self, src, path):
+        """Returns the list of source files that are used to build `path`."""
+        return [path]
+
+    def _targets(self, path):
+        """Returns the paths that `targets` would return for `path`, going by
+        what the handler already knows instead of the filesystem. It may be
+        called by other threads while a batch runs."""
+        return [path]
+
+    def _digest(self, src, path):
+        """Returns a digest of every file in `_sources(src, path)`, or None if
+        any of them is inaccessible."""
+        try:
+            return _digest.combine((source, _digest.digest(os.path.join(
+                src, source))) for source in self._sources(src, path))
+        except EnvironmentError:
+            return None
+
     def _build(self, src, path, dest, mtime):
         """Calls `build` after testing that at least one output file (as
         returned by `_outputs()` does not exist or is older than `mtime`. If
         the build fails, the build time is recorded and no other builds will be
         attempted on `input` until this method is called with a larger mtime.
-        """
+        Builds that get cancelled (see `gulpless.cancel`) are neither recorded
+        as failed nor completed."""
+        job = self._job(src, path, dest, mtime)
+        if job is None:
+            return
+
+        input_path, output_paths, digest = job
+        start = time.time()
+        key = self._cache_key(src, path, digest)
+        if key is not None and self.build_cache.restore(key, output_paths):
+            _snapshot.wrote(output_paths)
+            self._completed(path, start, digest, "restored")
+            return
+
+        error = None
+        try:
+            with trace.span("build", path=path):
+                if self.executor is not None:
+                    self.executor.build(self, src, path, input_path,
+                                        output_paths)
+                else:
+                    self.build(input_path, output_paths)
+        except Exception as e:
+            error = e
+        _snapshot.wrote(output_paths)
+
+        if cancel.cancelled():
+            # whatever the build did is obsolete; killed tools usually make
+            # it fail, but that's not worth recording
+            self._cancelled(path, start)
+        elif error is not None:
+            self._failed(path, start, error)
+        else:
+            if key is not None:
+                self.build_cache.store(key, output_paths)
+            self._completed(path, start, digest)
+
+    def _build_many(self, src, targets, dest):
+        """Like `_build`, but calls `build_many` once with every
+        (input_path, output_paths) tuple that needs to be built out of
+        `targets`, a dict that maps paths to their mtime. `build_many` should
+        return a dict that maps the input paths that failed to build to the
+        exception that caused it; if it raises instead, every input is
+        considered to have failed."""
+        jobs, keys = [], {}
+        for path, mtime in sorted(targets.items()):
+            job = self._job(src, path, dest, mtime)
+            if job is None:
+                continue
+
+            start = time.time()
+            key = keys[path] = self._cache_key(src, path, job[2])
+            if key is not None and self.build_cache.restore(key, job[1]):
+                _snapshot.wrote(job[1])
+                self._completed(path, start, job[2], "restored")
+            else:
+                jobs.append((path, ) + job)
+        if not jobs:
+            return
+
+        start = time.time()
+        try:
+            with trace.span("build many", paths=len(jobs)):
+                failures = self.build_many([(input_path, output_paths) for
+                                            path, input_path, output_paths,
+                                            digest in jobs]) or {}
+        except Exception as e:
+            failures = dict((input_path, e) for path, input_path, _, _ in jobs)
+        for path, input_path, output_paths, digest in jobs:
+            _snapshot.wrote(output_paths)
+
+        if cancel.cancelled():
+            for path, _, _, _ in jobs:
+                self._cancelled(path, start)
+            return
+
+        for path, input_path, output_paths, digest in jobs:
+            if input_path in failures:
+                self._failed(path, start, failures[input_path])
+            else:
+                if keys[path] is not None:
+                    self.build_cache.store(keys[path], output_paths)
+                self._completed(path, start, digest)
+
+    def _cache_key(self, src, path, digest):
+        """Returns the key of `path` in the build cache, or None if there is
+        no build cache or the key can't be determined. `digest` is the digest
+        of its sources, if it's already known."""
+        if self.build_cache is None:
+            return None
+        if digest is None:
+            digest = self._digest(src, path)
+            if digest is None:
+                return None
+        return self.build_cache.key(self._signature(), self.version, digest,
+                                    self._outputs(src, path))
+
+    def _job(self, src, path, dest, mtime):
+        """Returns an (input_path, output_paths, digest) tuple if `path` needs
+        to be built, or None if its outputs are up to date (or it is known to
+        fail)."""
         input_path = os.path.join(src, path)
         output_paths = [os.path.join(dest, output) for output in
                         self._outputs(src, path)]
@@ -85,88 +308,222 @@ class Handler(object):
         if path in self.failures and mtime <= self.failures[path]:
             # the input file was not modified since the last recorded failure
             # as such, assume that the task will fail again and skip it
-            return
+            trace.count("builds skipped")
+            return None
+
+        optional = set()
+        if self.optional and len(output_paths) == len(self.suffixes):
+            optional = set(output for output, suffix in
+                           zip(output_paths, self.suffixes)
+                           if suffix in self.optional)
 
         for output in output_paths:
             try:
-                if \
-                        os.path.exists(output) and \
-                        mtime <= os.path.getmtime(output):
+                if mtime <= _snapshot.getmtime(output):
                     # output file exists and is up to date; no need to trigger
                     # build on this file's expense
                     continue
             except EnvironmentError:
-                # usually happens when the output file has been deleted in
-                # between the call to exists and the call to getmtime
-                pass
-
-            start = time.time()
-            try:
-                self.build(input_path, output_paths)
-            except Exception as e:
-                if isinstance(e, EnvironmentError):
-                    # non-zero return code in sub-process; only show message
-                    logging.error("{0} failed after {1:.2f}s: {2}".format(
-                        termcolor.colored(path, "red", attrs=["bold"]),
-                        time.time() - start, e.args[0]
-                    ))
-                else:
-                    # probably a bug in the handler; show full trace
-                    logging.exception("{0} failed after {1:.2f}s".format(
-                        termcolor.colored(path, "red", attrs=["bold"]),
-                        time.time() - start
-                    ))
-                self.failures[path] = start
-            else:
-                logging.info("{0} completed in {1:.2f}s".format(
-                    termcolor.colored(path, "green", attrs=["bold"]),
-                    time.time() - start
-                ))
-                self.failures.pop(path, None)
+                if output in optional:
+                    # skipped by the previous build
+                    continue
             break
+        else:
+            trace.count("builds skipped")
+            return None
+
+        digest = None
+        if self.digest:
+            digest = self._digest(src, path)
+            if \
+                    digest is not None and \
+                    digest == self.digests.get(path) and \
+                    all(_snapshot.exists(output) or output in optional
+                        for output in output_paths):
+                # only the timestamps changed since the last build
+                logging.debug("{0} is unchanged".format(path))
+                trace.count("builds skipped")
+                return None
+
+        return input_path, output_paths, digest
+
+    def _failed(self, path, start, error):
+        trace.count("builds failed")
+        if isinstance(error, EnvironmentError):
+            # non-zero return code in sub-process; only show message
+            logging.error("{0} failed after {1:.2f}s: {2}".format(
+                termcolor.colored(path, "red", attrs=["bold"]),
+                time.time() - start, error.args[0] if error.args else error
+            ))
+        else:
+            # probably a bug in the handler; show full trace
+            logging.error("{0} failed after {1:.2f}s".format(
+                termcolor.colored(path, "red", attrs=["bold"]),
+                time.time() - start
+            ), exc_info=error)
+        self.failures[path] = start
+        self.digests.pop(path, None)
+
+    def _cancelled(self, path, start):
+        trace.count("builds cancelled")
+        logging.info("{0} cancelled after {1:.2f}s".format(
+            termcolor.colored(path, "yellow", attrs=["bold"]),
+            time.time() - start
+        ))
+
+    def _completed(self, path, start, digest, action="completed"):
+        trace.count("builds " + action)
+        logging.info("{0} {1} in {2:.2f}s".format(
+            termcolor.colored(path, "green", attrs=["bold"]),
+            action, time.time() - start
+        ))
+        self.failures.pop(path, None)
+        if digest is not None:
+            self.digests[path] = digest
+
+    def run_tool(self, tool, job):
+        """Runs `job` on the pool of long-lived workers registered as `tool`
+        (see `gulpless.workers.register`) and returns its result. Failures are
+        raised as EnvironmentError, so they are reported like a non-zero exit
+        code would be."""
+        return _workers.call(tool, job)
 
     def build(self, input_path, output_paths):
         """Should be extended by subclasses to actually do stuff. By default
-        this will copy `input` over every file in the `outputs` list."""
+        this will copy `input` over every file in the `outputs` list, in the
+        cheapest way `strategies` allow."""
         for output in output_paths:
-            shutil.copy(input_path, output_paths)
+            materialize(input_path, output, self.strategies)
 
 
 _base_path = re.compile("///.*?<base\s+path=[\"\'](.*)[\"\']\s*/>", re.I)
+# blank lines and comments, which are all that headers may contain
+_header = re.compile(br"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.S)
+_bom = b"\xef\xbb\xbf"
 
 
 class TreeHandler(Handler):
     def __init__(self, patterns, ignore_patterns=None, suffixes=[""],
-                 line_regex=_base_path):
+                 line_regex=_base_path, digest=False, header=None,
+                 cache=None):
         """Creates a new tree handler. `line_regex` is a regex that determines
         whether a file is self-sufficient or must be included in one (or more)
-        files."""
-        super(TreeHandler, self).__init__(patterns, ignore_patterns, suffixes)
+        files. When `digest` is true, the contents of all the files that are
+        included in a root are taken into account. If `header` is not None,
+        only the first `header` bytes of a file are searched for references,
+        stopping at the first thing that is neither blank nor a `//` or
+        `/* */` comment (after a UTF-8 BOM, if any). If `cache` is the name
+        of a file, the references are saved to it after every batch, so that
+        files that were not modified in the mean time don't have to be
+        searched again after a restart."""
+        super(TreeHandler, self).__init__(patterns, ignore_patterns, suffixes,
+                                          digest)
 
         self.line_regex = re.compile(line_regex)
+        self.header = header
+        self._line_regex = re.compile(
+            self.line_regex.pattern.encode("utf-8"),
+            self.line_regex.flags & ~re.UNICODE
+        )
         self.parents = {}  # maps a filename to a list of direct parents
         self.children = {}  # maps a filename to a list of direct children
+        self._roots = {}  # maps a filename to its roots and their mtimes
+
+        self.cache = cache
+        self._cached = None  # references loaded from the cache file
+        self._changed = False  # whether the cache file is out of date
+
+    def dump_state(self):
+        state = super(TreeHandler, self).dump_state()
+        state["parents"] = dict((path, [parents.updated, sorted(parents)])
+                                for path, parents in self.parents.items())
+        return state
+
+    def load_state(self, state):
+        parents, children = {}, {}
+        for path, (updated, references) in state["parents"].items():
+            path = _paths.intern(path)
+            parents[path] = TimedSet(float(updated))
+            parents[path].update(_paths.intern(parent)
+                                 for parent in references)
+            for parent in parents[path]:
+                children.setdefault(parent, set()).add(path)
+        for path in children:
+            if path not in parents:
+                raise ValueError("Missing reference to '{0}'".format(path))
+
+        super(TreeHandler, self).load_state(state)
+        self.parents, self.children = parents, children
+        self._roots = {}
+        self._changed = True
+
+    def _signature(self):
+        return super(TreeHandler, self)._signature() + \
+            [self.line_regex.pattern, self.header]
+
+    def _sources(self, src, path):
+        """Returns `path` along with every file that is (transitively) included
+        in it."""
+        sources = [path]
+        seen = set(sources)
+        for source in sources:
+            for child in self.children.get(source, ()):
+                if child not in seen:
+                    seen.add(child)
+                    sources.append(child)
+        return sources
+
+    def _targets(self, path):
+        roots = self._roots.get(path)
+        if roots is not None:
+            return list(roots)
+
+        # the batch may be changing the references; walk them without
+        # caching anything
+        roots, pending, seen = [], [path], set()
+        while pending:
+            path = pending.pop()
+            if path not in seen:
+                seen.add(path)
+                parents = self.parents.get(path)
+                if parents:
+                    pending.extend(parents)
+                else:
+                    roots.append(path)
+        return roots
 
     def rebuild_references(self, src, path, reject=None):
         """Updates `parents` and `children` to be in sync with the changes to
-        `src` if any."""
+        `src` if any. `reject` is the set of files whose references are being
+        rebuilt; none of them may be referenced by `path` or its parents."""
         if reject is None:
             reject = set()
-        reject.add(path)
 
         try:
             filename = os.path.join(src, path)
-            mtime = os.path.getmtime(filename)
-            contents = open(filename)
+            mtime = _snapshot.getmtime(filename)
         except EnvironmentError:
             raise ValueError("Unable to open '{0}'".format(path))
 
         if \
                 path in self.parents and \
                 self.parents[path].updated == mtime:
-            # cache hit; no need to update
+            # cache hit; no need to update, but the files that led here must
+            # not be among its parents
+            for parent in self._ancestors(path) if reject else ():
+                if parent in reject:
+                    raise ValueError("Circular reference to '{0}' "
+                                     "detected in '{1}'".format(parent, path))
             return
 
+        references = self._load_cache().pop(path, None)
+        if references is None or references[0] != mtime:
+            try:
+                with trace.span("references", path=path):
+                    references = None, self._references(filename)
+            except EnvironmentError:
+                raise ValueError("Unable to open '{0}'".format(path))
+
         # drop existing references
         if path in self.parents:
             self.deleted(src, path)
@@ -174,40 +531,139 @@ class TreeHandler(Handler):
         # build a list of parents
         parents = TimedSet(mtime)
         current = os.path.dirname(path)
+        reject.add(path)
 
-        for line in contents:
-            match = self.line_regex.search(line)
-            if match:
-                parent = match.group(1)
+        for parent in references[1]:
+            if references[0] is None:
+                # only files that were actually read need to be checked
                 relative = os.path.normpath(os.path.join(current, parent))
                 if relative.startswith(".."):
                     raise ValueError("Parent reference '{0}' outside of "
                                      "watched folder in '{1}'".format(parent,
                                                                       path))
                 parent = os.path.normcase(relative)
-                if parent in reject:
-                    raise ValueError("Circular reference to '{0}' "
-                                     "detected in '{1}'".format(parent,
-                                                                path))
-                parents.add(parent)
-
-        for parent in parents:
-            # recursively build references for all parents; this will
-            # usually be a cache hit and no-op
-            self.rebuild_references(src, parent, reject)
+            if parent in reject:
+                raise ValueError("Circular reference to '{0}' "
+                                 "detected in '{1}'".format(parent, path))
+            parents.add(_paths.intern(parent))
 
+        try:
+            for parent in parents:
+                # recursively build references for all parents; this will
+                # usually be a cache hit and no-op
+                self.rebuild_references(src, parent, reject)
+        finally:
+            reject.discard(path)
+
+        path = _paths.intern(path)
         self.parents[path] = parents
+        self._invalidate(path)
+        self._changed = True
         for parent in parents:
             # add this node to each of its parents' children
             if parent not in self.children:
                 self.children[parent] = set()
             self.children[parent].add(path)
 
+    def flush(self):
+        """Saves the reference graph to the cache file, if there is one."""
+        if not self.cache or not self._changed:
+            return
+
+        cache = {
+            "version": 2,
+            "signature": self._signature(),
+            "parents": self.dump_state()["parents"]
+        }
+        try:
+            atomic_write(self.cache, json.dumps(cache).encode("utf-8"))
+            self._changed = False
+        except EnvironmentError as e:
+            logging.warning("Unable to save references to '{0}': "
+                            "{1}".format(self.cache, e))
+
+    def _load_cache(self):
+        """Returns a dict that maps files to the (mtime, parents) they had when
+        the cache file was last saved. Entries are meant to be removed as soon
+        as they are used."""
+        if self._cached is not None:
+            return self._cached
+
+        self._cached = {}
+        if not self.cache:
+            return self._cached
+
+        try:
+            with open(self.cache, "rb") as f:
+                cache = json.loads(f.read().decode("utf-8"))
+        except EnvironmentError:
+            # no previous cache
+            return self._cached
+        except ValueError:
+            logging.warning("Reference cache in '{0}' is corrupt; ignoring "
+                            "it".format(self.cache))
+            return self._cached
+
+        try:
+            if \
+                    cache["version"] == 2 and \
+                    cache["signature"] == self._signature():
+                self._cached = dict(
+                    (path, (float(mtime), [str(parent) for parent in parents]))
+                    for path, (mtime, parents) in cache["parents"].items()
+                )
+        except (KeyError, TypeError, ValueError):
+            logging.warning("Reference cache in '{0}' is corrupt; ignoring "
+                            "it".format(self.cache))
+        return self._cached
+
+    def _ancestors(self, path):
+        """Yields every (transitive) parent of `path`."""
+        pending = list(self.parents.get(path, ()))
+        seen = set(pending)
+        while pending:
+            parent = pending.pop()
+            yield parent
+            for ancestor in self.parents.get(parent, ()):
+                if ancestor not in seen:
+                    seen.add(ancestor)
+                    pending.append(ancestor)
+
+    def _references(self, filename):
+        """Returns the first group of every match of `line_regex` in
+        `filename`. The file is memory mapped and searched as bytes, so large
+        files are neither decoded nor split into lines."""
+        with open(filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.header is not None:
+                size = min(size, self.header)
+            if not size:
+                return []
+
+            try:
+                contents = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                # some files (e.g. on special filesystems) can't be mapped
+                contents = f.read(size)
+
+        try:
+            end = size
+            if self.header is not None:
+                # stop at the first thing that can't be part of the header
+                start = len(_bom) if contents[:len(_bom)] == _bom else 0
+                end = _header.match(contents, start, size).end()
+
+            references = []
+            for match in self._line_regex.finditer(contents, 0, end):
+                if b"\n" not in match.group(0):
+                    references.append(match.group(1).decode("utf-8"))
+            return references
+        finally:
+            if isinstance(contents, mmap.mmap):
+                contents.close()
+
     def handles(self, src, path):
-        if \
-                not pathtools.patterns.match_path(path, self.patterns,
-                                                  self.ignore_patterns) and \
-                path not in self.children:
+        if not self.matches(path) and not self.claims(path):
             # allow both files that match the pattern as well as explicitly
             # defined parent files
             return None
@@ -218,11 +674,13 @@ class TreeHandler(Handler):
             self.rebuild_references(src, path)
         except ValueError as e:
             # there was an error processing this file
-            logging.error("{0} failed after {1:.2f}s: {1}".format(
+            logging.error("{0} failed after {1:.2f}s: {2}".format(
                 termcolor.colored(path, "red", attrs=["bold"]),
                 time.time() - start, e.args[0]
             ))
+            self.errors[path] = start
             return None
+        self.errors.pop(path, None)
 
         # only files that don't have any parent produce output via this handler
         if self.parents[path]:
@@ -230,8 +688,14 @@ class TreeHandler(Handler):
         else:
             return self._outputs(src, path)
 
+    def claims(self, path):
+        """Parent files are handled even if they don't match the patterns."""
+        return path in self.children
+
     def deleted(self, src, path):
         """Update the reference tree when a handled file is deleted."""
+        self._invalidate(path)
+        self._changed = True
         if self.parents[path] is not None:
             for parent in self.parents[path]:
                 self.children[parent].remove(path)
@@ -239,23 +703,50 @@ class TreeHandler(Handler):
                     del self.children[parent]
         del self.parents[path]
 
-    def changed(self, src, path, dest):
-        """If `path` does not have any parents, it is built. Otherwise, it will
-        attempt to build every parent of `path` (or their parents). Output file
-        modification times are taken into account to prevent unnecessary
-        builds."""
-        modified = {path: self.parents[path].updated}
-
-        while True:
-            for path in modified:
-                if self.parents[path]:
-                    mtime = modified.pop(path)
-                    for parent in self.parents[path]:
-                        modified[parent] = max(mtime,
-                                               self.parents[parent].updated)
-                    break
-            else:
-                break
-
-        for path in modified:
-            self._build(src, path, dest, modified[path])
+    def targets(self, src, path):
+        """If `path` does not have any parents, it is returned. Otherwise,
+        every parent of `path` (or their parents) is returned instead, along
+        with the most recent modification time on the way there. Output file
+        modification times are taken into account by `_build` to prevent
+        unnecessary builds."""
+        return dict(self._resolve(path))
+
+    def _resolve(self, path):
+        """Returns a dict that maps every root of `path` to the most recent
+        modification time on the way there. Results are cached until the
+        references of `path` or any of its parents change, unless some of its
+        parents were missing."""
+        roots = self._roots.get(path)
+        if roots is None:
+            parents = self.parents[path]
+            roots = {}
+            complete = True
+            for parent in parents:
+                if parent not in self.parents:
+                    # the parent was deleted; it will be rebuilt (or not)
+                    # when it gets recreated
+                    complete = False
+                    continue
+                for root, mtime in self._resolve(parent).items():
+                    roots[root] = max(mtime, parents.updated,
+                                      roots.get(root, mtime))
+                if parent not in self._roots:
+                    # the parent's roots weren't complete either
+                    complete = False
+            if not parents:
+                roots[path] = parents.updated
+            if complete:
+                self._roots[path] = roots
+        return roots
+
+    def _invalidate(self, path):
+        """Drops the cached roots of `path` and everything that is included in
+        it."""
+        pending, seen = [path], set()
+        while pending:
+            path = pending.pop()
+            if path not in seen:
+                # its children may have cached roots even if it has none
+                seen.add(path)
+                self._roots.pop(path, None)
+                pending.extend(self.children.get(path, ()))
@@ -2,19 +2,58 @@
 from __future__ import absolute_import, unicode_literals, division
 
 import gzip as _gzip
+import tempfile
+import shutil
+import stat
+import os
 
 
-__all__ = ["gzip"]
+__all__ = ["gzip", "atomic_write"]
 
 
 def gzip(original, compressed, *gzip_args, **gzip_kwargs):
+    """Compresses `original` into `compressed`. Kept for compatibility; see
+    `gulpless.compress` for a faster alternative."""
     orig = comp = None
     try:
         orig = open(original, "rb")
         comp = _gzip.open(compressed, "wb", *gzip_args, **gzip_kwargs)
-        comp.writelines(orig)
+        # writelines would split binary files on every newline byte
+        shutil.copyfileobj(orig, comp, 1 << 20)
     finally:
         if comp:
             comp.close()
         if orig:
             orig.close()
+
+
+def atomic_write(filename, data):
+    """Replaces the contents of `filename` with the `data` bytestring. Readers
+    will either see the old or the new version of the file, never a partially
+    written one."""
+    folder, name = os.path.split(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(prefix=name + ".", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        atomic_replace(temp, filename)
+    except Exception:
+        os.unlink(temp)
+        raise
+
+
+# the umask of the process, which can only be read by changing it
+_umask = os.umask(0o022)
+os.umask(_umask)
+
+
+def atomic_replace(temp, filename):
+    """Moves the temporary file `temp` (as created by `tempfile.mkstemp`, which
+    only lets its owner access it) over `filename`, giving it the permissions
+    of the file it replaces, or the ones a new file would have."""
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except EnvironmentError:
+        mode = 0o666 & ~_umask
+    os.chmod(temp, mode)
+    getattr(os, "replace", os.rename)(temp, filename)
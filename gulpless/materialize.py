@@ -0,0 +1,136 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+
+import tempfile
+import shutil
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__all__ = ["STRATEGIES", "DEFAULT", "materialize"]
+
+
+# every way of copying a file, from the cheapest to the most expensive one
+STRATEGIES = ("hardlink", "reflink", "copy_file_range", "sendfile", "copy")
+
+# hardlinks are opt-in, since they share the data of the source: a tool that
+# modifies an output in place would modify the source as well
+DEFAULT = ("reflink", "copy_file_range", "sendfile", "copy")
+
+CHUNK_SIZE = 1 << 20
+
+FICLONE = 0x40049409  # from linux/fs.h
+
+# errors that mean a strategy isn't supported by a pair of filesystems
+_UNSUPPORTED = set(getattr(errno, name) for name in [
+    "EXDEV", "EOPNOTSUPP", "ENOTSUP", "ENOSYS", "EINVAL", "ENOTTY", "EPERM",
+    "EBADF", "EMLINK"
+] if hasattr(errno, name))
+
+# maps a (source device, target device) tuple to the strategies that failed
+_unsupported = {}
+
+
+def materialize(source, target, strategies=None):
+    """Makes `target` a copy of `source` using the first of `strategies` (a
+    list of `STRATEGIES`, `DEFAULT` if None) that works on their filesystems.
+    Strategies that turn out not to be supported are not attempted again for
+    the same pair of filesystems. `target` is always replaced by a new file,
+    so it never shares data with a previous version of itself; in particular,
+    replacing (or deleting) a hardlinked output never affects the source.
+    Returns the name of the strategy that was used."""
+    if strategies is None:
+        strategies = DEFAULT
+    for strategy in strategies:
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy '{0}'".format(strategy))
+
+    folder = os.path.dirname(os.path.abspath(target))
+    key = os.stat(source).st_dev, os.stat(folder).st_dev
+    unsupported = _unsupported.setdefault(key, set())
+
+    for strategy in strategies:
+        if strategy in unsupported:
+            continue
+        try:
+            if strategy == "hardlink":
+                _link(source, target)
+            else:
+                _copy(source, target, _copiers[strategy])
+            return strategy
+        except EnvironmentError as e:
+            if strategy == "copy" or e.errno not in _UNSUPPORTED:
+                raise
+            unsupported.add(strategy)
+    raise EnvironmentError("None of {0} can copy '{1}' to '{2}'".format(
+        list(strategies), source, target))
+
+
+def _temp(target):
+    folder, name = os.path.split(os.path.abspath(target))
+    return tempfile.mkstemp(prefix=name + ".", dir=folder)
+
+
+def _link(source, target):
+    fd, temp = _temp(target)
+    os.close(fd)
+    os.unlink(temp)
+    os.link(source, temp)
+    try:
+        getattr(os, "replace", os.rename)(temp, target)
+    except Exception:
+        os.unlink(temp)
+        raise
+
+
+def _copy(source, target, copier):
+    fd, temp = _temp(target)
+    try:
+        with os.fdopen(fd, "wb") as dst, open(source, "rb") as src:
+            copier(src, dst, os.fstat(src.fileno()).st_size)
+        shutil.copymode(source, temp)
+        getattr(os, "replace", os.rename)(temp, target)
+    except Exception:
+        os.unlink(temp)
+        raise
+
+
+def _reflink(src, dst, size):
+    if fcntl is None:
+        raise EnvironmentError(errno.ENOSYS, "Reflinks are not supported")
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _copy_file_range(src, dst, size):
+    if not hasattr(os, "copy_file_range"):
+        raise EnvironmentError(errno.ENOSYS, "copy_file_range is missing")
+    while os.copy_file_range(src.fileno(), dst.fileno(), CHUNK_SIZE << 4):
+        pass
+
+
+def _sendfile(src, dst, size):
+    if not hasattr(os, "sendfile"):
+        raise EnvironmentError(errno.ENOSYS, "sendfile is missing")
+    offset = 0
+    while True:
+        sent = os.sendfile(dst.fileno(), src.fileno(), offset, CHUNK_SIZE << 4)
+        if not sent:
+            break
+        offset += sent
+
+
+def _plain_copy(src, dst, size):
+    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+_copiers = {
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _sendfile,
+    "copy": _plain_copy
+}
@@ -0,0 +1,64 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+
+import threading
+import sys
+
+
+__all__ = ["PathTable", "table", "intern"]
+
+
+class PathTable(object):
+    def __init__(self):
+        """Creates a new table of interned paths. The same path tends to be
+        kept by the scanners, the reactors and the handlers at once; if all of
+        them intern it, they share a single string instead of one copy each.
+        Paths that nothing else refers to anymore are dropped by `prune`."""
+        super(PathTable, self).__init__()
+
+        self._paths = {}  # maps every path to itself
+        self._lock = threading.Lock()  # held while pruning
+        self._pruned = 0  # the number of paths after the last pruning
+        self._unused = object()  # never referenced outside of the table
+        self._paths[self._unused] = self._unused
+
+    def __len__(self):
+        return len(self._paths) - 1
+
+    def intern(self, path):
+        """Returns the string in the table that is equal to `path`, adding
+        `path` if there is none."""
+        return self._paths.setdefault(path, path)
+
+    def prune(self, force=False):
+        """Drops the paths that are only referenced by the table. Since that
+        takes a while, it's only done once the table has doubled in size
+        since it was last pruned, unless `force` is true."""
+        getrefcount = getattr(sys, "getrefcount", None)
+        if getrefcount is None or not self._lock.acquire(False):
+            # no reference counts on this interpreter, or already pruning
+            return
+        try:
+            if not force and len(self._paths) < 2 * self._pruned:
+                return
+
+            # a path that is only kept by the table has as many references
+            # as the `_unused` object, minus the attribute
+            paths = list(self._paths)
+            for path in paths:
+                if path is self._unused:
+                    unused = getrefcount(path) - 1
+            for path in paths:
+                if getrefcount(path) <= unused:
+                    self._paths.pop(path, None)
+            self._pruned = len(self._paths)
+        finally:
+            self._lock.release()
+
+
+table = PathTable()
+
+
+def intern(path):
+    """Interns `path` in the shared table."""
+    return table.intern(path)
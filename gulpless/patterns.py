@@ -0,0 +1,138 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+
+import re
+import os
+
+
+__all__ = ["translate", "compile", "extension", "Dispatcher"]
+
+
+_separators = "/" + os.sep if os.sep != "/" else "/"
+_glob = re.compile(r"[*?[\]]")
+
+
+def translate(pattern):
+    """Translates a glob pattern into a regular expression. `*`, `?` and
+    `[seq]` behave like they do in `fnmatch` (in particular, `*` also matches
+    folder separators), while `**/` matches any number of folders, including
+    none at all, and a trailing `/**` matches anything inside a folder."""
+    result = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if i < n and pattern[i] == "*":
+                i += 1
+                if i < n and pattern[i] in _separators:
+                    # `**/` also matches the current folder
+                    i += 1
+                    result.append("(?:.*[{0}])?".format(re.escape(
+                        _separators)))
+                elif i == n and result and result[-1] in \
+                        [re.escape(sep) for sep in _separators]:
+                    # `/**` also matches the folder itself
+                    result[-1] = "(?:[{0}].*)?".format(re.escape(
+                        _separators))
+                else:
+                    result.append(".*")
+            else:
+                result.append(".*")
+        elif c == "?":
+            result.append(".")
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                result.append(re.escape(c))
+            else:
+                seq = pattern[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if seq.startswith("!"):
+                    seq = "^" + seq[1:]
+                elif seq.startswith("^"):
+                    seq = "\\" + seq
+                result.append("[{0}]".format(seq))
+        else:
+            result.append(re.escape(c))
+    return "".join(result)
+
+
+def compile(patterns):
+    """Compiles a list of glob patterns into a single regular expression that
+    matches a path if any of the patterns does."""
+    if not patterns:
+        return re.compile("(?!)")
+    return re.compile("(?s:{0})\\Z".format("|".join(
+        "(?:{0})".format(translate(pattern)) for pattern in patterns)))
+
+
+def extension(pattern):
+    """Returns the extension of every path matched by `pattern`, or None if
+    it can't be determined."""
+    name = re.split("[{0}]".format(re.escape(_separators)), pattern)[-1]
+    ext = _extension(name)
+    if _glob.search(ext) or not ext and _glob.search(name):
+        return None
+    return ext
+
+
+def _extension(name):
+    # unlike `os.path.splitext`, this considers `.js` to be an extension
+    i = name.rfind(".")
+    return name[i:] if i >= 0 else ""
+
+
+class Dispatcher(object):
+    def __init__(self):
+        """Creates a new index that quickly finds the handlers that may be
+        interested in a path based on the extensions their patterns match."""
+        super(Dispatcher, self).__init__()
+
+        self._handlers = []  # a list of (handler, extensions) tuples
+        self._dynamic = []  # a list of handlers that may claim any path
+        self._candidates = {}  # maps an extension to a list of handlers
+
+    def add(self, handler):
+        """Adds `handler` to the index."""
+        extensions = set()
+        for pattern in handler.patterns:
+            ext = extension(pattern)
+            if ext is None:
+                extensions = None
+                break
+            extensions.add(ext)
+
+        self._handlers.append((handler, extensions))
+        if handler.claims is not None:
+            self._dynamic.append(handler)
+        self._candidates = {}
+
+    def candidates(self, path):
+        """Returns every handler that may handle `path`, in the order they
+        were added in."""
+        ext = _extension(path.rsplit(os.sep, 1)[-1])
+        try:
+            candidates = self._candidates[ext]
+        except KeyError:
+            candidates = self._candidates[ext] = [
+                handler for handler, extensions in self._handlers
+                if extensions is None or ext in extensions
+            ]
+
+        if not self._dynamic:
+            return candidates
+
+        # some handlers also accept paths that don't match their patterns
+        dynamic = [handler for handler in self._dynamic
+                   if handler not in candidates and handler.claims(path)]
+        if not dynamic:
+            return candidates
+        return [handler for handler, extensions in self._handlers
+                if handler in candidates or handler in dynamic]
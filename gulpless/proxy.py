@@ -1,80 +1,144 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, division
+from gulpless.scanner import Scanner
+from gulpless import trace
 
-import watchdog.events
+import threading
+import time
 import os
 
 
-class Proxy(watchdog.events.FileSystemEventHandler):
-    def __init__(self, observer, path, change):
+class Proxy(object):
+    def __init__(self, path, change, rescan=30, scheduler=None):
+        """Keeps track of the changes to `path`. Once it `watch`es the folder,
+        `change` is called whenever a FS event occurs. Only the paths
+        mentioned by events are rescanned, but since those are not entirely
+        reliable, the whole tree is scanned anyway if more than `rescan`
+        seconds have passed since it was last done. `scheduler` is passed on
+        to the `gulpless.scanner.Scanner`."""
         super(Proxy, self).__init__()
 
-        observer.schedule(self, path, True)
         self.path = path
+        self.rescan = rescan
         self._changed = change
 
         self.updated = True
-        self.files = {}
+        self._scanner = Scanner(path, scheduler=scheduler)
+
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()  # held while the tree is scanned
+        self._scanned = None  # when the whole tree was last scanned
+        self._roots = set()  # paths that must be scanned recursively
+        self._folders = set()  # folders whose entries must be listed
+
+    def watch(self, observer):
+        """Schedules a recursive watch of the folder on `observer` (see
+        `Observer`)."""
+        observer.schedule(self, self.path, recursive=True)
+
+    @property
+    def due(self):
+        """Whether the whole tree needs to be scanned."""
+        return \
+            self._scanned is None or \
+            time.time() - self._scanned >= self.rescan
+
+    def dispatch(self, event):
+        """Called by the observer with every FS event."""
+        self.on_any_event(event)
 
     def on_any_event(self, event):
         """Called whenever a FS event occurs."""
-        self.updated = True
+        if event.event_type in ("opened", "closed_no_write"):
+            # files were only read; this happens a lot during builds
+            return
+
+        paths = [event.src_path, getattr(event, "dest_path", None)]
+        with self._lock:
+            for path in paths:
+                if not path:
+                    continue
+                path = os.path.normcase(os.path.relpath(path, self.path))
+                if path == os.curdir:
+                    path = ""
+                elif path == os.pardir or path.startswith(os.pardir + os.sep):
+                    continue
+
+                if event.is_directory and event.event_type == "modified":
+                    # only the folder's entries have changed
+                    self._folders.add(path)
+                else:
+                    self._roots.add(path)
+                    self._folders.add(os.path.dirname(path))
+            self.updated = True
+
         if self._changed:
             self._changed()
 
+    def pending(self):
+        """Returns the paths that FS events were seen for since the last call
+        to `changes`."""
+        with self._lock:
+            return list(self._roots)
+
+    @property
+    def files(self):
+        """A snapshot of the `gulpless.scanner.Files` that maps every known
+        path to its modification time, as of the last scan."""
+        with self._scan_lock:
+            return self._scanner.files
+
+    @files.setter
+    def files(self, files):
+        with self._scan_lock:
+            self._scanner.files = files
+
     def changes(self):
         """Collects all changes that have been performed on the monitored path,
         returning them as a (created, deleted) tuple."""
-        deleted = []
-        for path in list(self.files):
-            isdir = path.endswith(os.sep)
-            abspath = os.path.join(self.path, path)
-            try:
-                is_deleted = (
-                    not os.path.exists(abspath) or  # actually deleted
-                    os.path.isdir(abspath) != isdir  # changed from / to folder
-                )
-            except EnvironmentError:
-                # file is basically inaccessible at this point so we're gonna
-                # assume that it was deleted
-                is_deleted = True
-
-            if is_deleted:
-                deleted.append(path)
-                del self.files[path]
-
-        changed = []
-        for folder, subfolders, subfiles in os.walk(self.path):
-            for path in subfolders:
-                path = os.path.join(folder, path)
-                path = os.path.normcase(os.path.relpath(path, self.path))
-                path += os.sep
-                if path not in self.files:
-                    # don't really care about folder mtime
-                    self.files[path] = 0
-                    changed.append(path)
-
-            for path in subfiles:
-                actual_path = path = os.path.join(folder, path)
-                path = os.path.normcase(os.path.relpath(path, self.path))
-                try:
-                    mtime = os.path.getmtime(actual_path)
-                    if path not in self.files:
-                        # new file; set its mtime to 0 because it will be
-                        # compared in the next few lines
-                        self.files[path] = 0
-
-                    if mtime > self.files[path]:
-                        # file has been changed since last check
-                        self.files[path] = mtime
-                        changed.append(path)
-                except EnvironmentError:
-                    # in 99% of the cases the file has been deleted while
-                    # iterating the parent folder; if the file was previously
-                    # being handled, then stop handling it; otherwise ignore
-                    if path in self.files:
-                        deleted.append(path)
-                        del self.files[path]
-
-        self.updated = False
-        return changed, deleted
+        with self._lock:
+            roots, self._roots = self._roots, set()
+            folders, self._folders = self._folders, set()
+            self.updated = False
+
+        # batches may read `files` while the next one is being collected
+        with self._scan_lock:
+            if self.due or "" in roots:
+                self._scanned = time.time()
+                with trace.span("scan", path=self.path, full=True):
+                    return self._scanner.scan()
+            with trace.span("scan", path=self.path, full=False):
+                return self._scanner.scan(roots, folders)
+
+
+class Observer(object):
+    def __init__(self):
+        """Stands in for a watchdog observer, which is only created (and
+        watchdog only imported) once something is scheduled on it or it is
+        started, so that one-shot builds, which don't watch anything, don't
+        pay for it."""
+        super(Observer, self).__init__()
+
+        self._lock = threading.Lock()
+        self._observer = None
+
+    def schedule(self, handler, path, recursive=False):
+        return self._get().schedule(handler, path, recursive=recursive)
+
+    def start(self):
+        self._get().start()
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+
+    def join(self, timeout=None):
+        if self._observer is not None and self._observer.is_alive():
+            self._observer.join(timeout)
+
+    def _get(self):
+        with self._lock:
+            if self._observer is None:
+                import watchdog.observers
+                self._observer = watchdog.observers.Observer()
+            return self._observer
@@ -1,48 +1,123 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals, division
 from gulpless.collector import Collector
+from gulpless.proxy import Observer
+from gulpless.scheduler import Scheduler
+from gulpless.patterns import Dispatcher
+from gulpless.helpers import atomic_write
+from gulpless.cache import BuildCache
+from gulpless import snapshot
+from gulpless import scanner
+from gulpless import workers
+from gulpless import cancel
+from gulpless import trace
+from gulpless import digest
+from gulpless import paths
 
-import watchdog.observers
+import threading
 import logging
+import json
 import time
 import os
 
 
 class Reactor(object):
+    STATE_VERSION = 5
 
-    def __init__(self, src_path, dest_path, bundle=0.2, timeout=150):
+    # builds of files that were edited less than this many seconds ago get
+    # the rest of it as a head start in the build queue
+    RECENT = 30
+
+    def __init__(self, src_path, dest_path, bundle=0.2, timeout=150, jobs=1,
+                 state=None, rescan=30, cache=None, observer=None,
+                 scheduler=None, detector=None, executor=None):
+        """Creates a new reactor that keeps `dest_path` in sync with
+        `src_path`. If `state` is the name of a file, the reactor's knowledge
+        of both folders is saved to it after every batch and restored from it
+        on startup, so that the first batch only needs to deal with the files
+        that were changed in the mean time. FS events only cause the affected
+        paths to be rescanned, but both folders are fully scanned every
+        `rescan` seconds in case some events went missing. Changes are
+        collected once events stop arriving for a while (see `Collector`), even
+        while the previous batch is still running; builds whose sources change
+        again in the mean time are cancelled and started over right away.
+        `cache` may be a `gulpless.cache.BuildCache` (or the name of its
+        folder) that is used by every handler that doesn't have a build cache
+        of its own. If `observer` (see `gulpless.proxy.Observer`),
+        `scheduler` or `detector` (see `gulpless.collector.Detector`) are not
+        None, they are shared with other reactors (see `gulpless.group.Group`);
+        their owner starts and stops them, and `jobs` is ignored. `executor`
+        may be a `gulpless.remote.RemoteExecutor` that runs the builds of
+        every handler that doesn't have an executor of its own."""
         super(Reactor, self).__init__()
 
         self._src_path = os.path.normcase(os.path.abspath(src_path))
         self._dest_path = os.path.normcase(os.path.abspath(dest_path))
 
-        self._observer = watchdog.observers.Observer()
-        self._collector = Collector(self._observer,
-                                    self._src_path, self._dest_path,
-                                    bundle, timeout, self._batch)
+        self._observer = observer or Observer()
+        self._own_observer = observer is None
+        self._collector = Collector(self._src_path, self._dest_path,
+                                    bundle, timeout, self._batch, rescan,
+                                    interrupt=self._interrupt,
+                                    detector=detector)
+        self._scheduler = scheduler or Scheduler(jobs,
+                                                 counter="queue wait (s)")
+        self._own_scheduler = scheduler is None
 
-        self._inputs = {}  # maps inputs to their list of outputs
+        self._inputs = {}  # maps inputs to their (handler, outputs) tuples
         self._outputs = {}  # maps outputs to their input
         self._handlers = []  # a list of file handlers
+        self._dispatcher = Dispatcher()  # finds handlers for a path
         self._initial = True  # whether this is the first run or not
+        self._restored = False  # whether the initial state was loaded
+        self._state = state
         self._once = False
+        self._crashed = False  # whether a batch failed with a run-time error
+
+        self._lock = threading.Lock()
+        self._running = {}  # maps the tokens of pending builds to sources
+        self._producers = {}  # maps outputs to the task that builds them
+        self._built = threading.Condition(self._lock)  # a task completed
+        self._dispatched = 0  # the collector's `current` as of the last batch
+        self._snapshot = None  # the `gulpless.snapshot.Snapshot` of the batch
+
+        if cache is not None and not isinstance(cache, BuildCache):
+            cache = BuildCache(cache)
+        self._cache = cache
+        self._executor = executor
 
     def add_handler(self, handler):
         self._handlers.append(handler)
+        self._dispatcher.add(handler)
+        if handler.build_cache is None:
+            handler.build_cache = self._cache
+        if handler.executor is None:
+            handler.executor = self._executor
 
     def start(self):
-        self._collector.start()
-        self._observer.start()
+        if self._state:
+            self._load_state()
+        # a batch that has nothing to do may stop the reactor right away
         self.running = True
+        self._collector.watch(self._observer)
+        self._collector.start()
+        if self._own_observer:
+            self._observer.start()
 
     def stop(self):
-        self._observer.stop()
+        if self._own_observer:
+            self._observer.stop()
         self._collector.stop()
+        if self._own_scheduler:
+            self._scheduler.stop()
+            workers.close()
         self.running = False
 
     def join(self, timeout=None):
-        self._observer.join()
-        self._collector.join()
+        if self._own_observer:
+            self._observer.join()
+        if self._collector.is_alive():
+            self._collector.join()
 
     def run(self, once=False):
         """Runs the reactor in the main thread."""
@@ -55,6 +130,27 @@ class Reactor(object):
                 self.stop()
                 self.join()
 
+    def build(self):
+        """Brings the output folder up to date with a single scan and batch,
+        all in the calling thread and without watching either folder. Returns
+        whether that succeeded: whether no batch failed, no handler has an
+        error on record for any source file, and no current input failed to
+        build (including the ones that failed before and haven't changed
+        since)."""
+        if self._state:
+            self._load_state()
+        self._once = True
+        self.running = True
+        try:
+            self._collector.collect()
+        finally:
+            if self.running:
+                self.stop()
+        return not self._crashed and not any(
+            handler.errors for handler in self._handlers) and not any(
+            path in handler.failures for path, entries in self._inputs.items()
+            for handler, outputs in entries)
+
     def _parents(self, path):
         if path.endswith(os.sep):
             path = os.path.dirname(path)
@@ -65,107 +161,502 @@ class Reactor(object):
             yield path
 
     def _prepare_output(self, path):
-        for segment in reversed(list(self._parents(path))):
-            out = os.path.join(self._dest_path, segment)
-            if os.path.exists(out) and not os.path.isdir(out):
-                if segment in self._outputs:
-                    raise ValueError("Invalid output structure: '{0}' is "
-                                     "both a folder and a file".format(out))
-                os.unlink(out)
-
-            if not os.path.exists(out):
-                os.mkdir(out)
-            self._outputs[segment + os.sep] = True
-        self._outputs[path] = True
+        with trace.span("prepare output", path=path):
+            for segment in reversed(list(self._parents(path))):
+                out = os.path.join(self._dest_path, segment)
+                if snapshot.isdir(out):
+                    self._outputs[paths.intern(segment + os.sep)] = True
+                    continue
+                if os.path.exists(out) and not os.path.isdir(out):
+                    if segment in self._outputs:
+                        raise ValueError("Invalid output structure: '{0}' "
+                                         "is both a folder and a "
+                                         "file".format(out))
+                    os.unlink(out)
 
-    def _clean_output(self, path):
-        # delete output file
-        out = os.path.join(self._dest_path, path)
-        if os.path.exists(out):
-            os.unlink(out)
+                if not os.path.exists(out):
+                    os.mkdir(out)
+                self._outputs[paths.intern(segment + os.sep)] = True
+            self._outputs[path] = True
 
-        # delete parent folders if possible
-        for segment in self._parents(path):
-            out = os.path.join(self._dest_path, segment)
+    def _clean_output(self, path, folders=True):
+        """Deletes the output `path`, along with its parent folders if they
+        are left empty, unless `folders` is false."""
+        with trace.span("clean output", path=path):
+            # delete output file
+            out = os.path.join(self._dest_path, path)
             if os.path.exists(out):
-                try:
-                    os.rmdir(out)
-                    del self._outputs[segment + os.sep]
-                except OSError:
-                    # current folder is not empty
-                    break
+                os.unlink(out)
+                snapshot.wrote([out])
+
+            # delete parent folders if possible
+            for segment in self._parents(path) if folders else ():
+                out = os.path.join(self._dest_path, segment)
+                if os.path.exists(out):
+                    try:
+                        os.rmdir(out)
+                        snapshot.wrote([out])
+                        del self._outputs[segment + os.sep]
+                    except OSError:
+                        # current folder is not empty
+                        break
 
     def _batch_dest(self, updated, deleted):
+        with trace.span("dest", files=len(updated) + len(deleted)):
+            self._sync_dest(updated, deleted)
+
+    def _sync_dest(self, updated, deleted):
         for path in sorted(updated, key=len, reverse=True):
             if path not in self._outputs:
-                # an unexpected file or folder was created in the output tree
+                # an unexpected file or folder was created in the output tree;
+                # it may also be a temporary file that was collected while the
+                # previous batch was running, and is already gone
                 out = os.path.join(self._dest_path, path)
-                if os.path.isdir(out):
-                    os.rmdir(out)
-                else:
-                    os.unlink(out)
+                try:
+                    if os.path.isdir(out):
+                        os.rmdir(out)
+                    else:
+                        os.unlink(out)
+                    snapshot.wrote([out])
+                except OSError:
+                    if os.path.lexists(out):
+                        raise
 
         for path in sorted(deleted, key=len):
             if path in self._outputs and path.endswith(os.sep):
                 # an output folder was deleted; re-create
                 out = os.path.join(self._dest_path, path)
-                os.mkdir(out)
+                if not os.path.isdir(out):
+                    os.mkdir(out)
 
     def _batch_src(self, updated, deleted):
+        with trace.span("dispatch", files=len(updated)):
+            builds = self._dispatch(updated)
+
+        # all output folders have been prepared at this point, so builds may
+        # safely run in parallel; handlers that can build many files at once
+        # get all of theirs in a single task
+        tasks, batches = [], {}
+        for (handler, path), mtime in builds.items():
+            if handler.build_many is not None:
+                batches.setdefault(handler, {})[path] = mtime
+            else:
+                tasks.append((handler, {path: mtime},
+                              self._build_task(handler, path, mtime)))
+        for handler, targets in batches.items():
+            tasks.append((handler, targets,
+                          self._batch_task(handler, targets)))
+
+        with self._lock:
+            for i, (handler, targets, task) in enumerate(tasks):
+                outputs = [out_path for path in targets for out_path in
+                           handler._outputs(self._src_path, path)]
+                task = self._tracked(outputs, task)
+                for out_path in outputs:
+                    self._producers[out_path] = task
+                tasks[i] = handler, targets, task
+            self._dispatched = self._collector.current
+            self._built.notify_all()
+        with trace.span("builds", tasks=len(tasks)):
+            self._scheduler.run((self._priority(handler, targets), task)
+                                for handler, targets, task in tasks)
+        with self._lock:
+            self._producers = {}
+
+        for path in sorted(deleted, key=len, reverse=True):
+            for handler in self._handlers:
+                handler.errors.pop(path, None)
+            if path in self._inputs:
+                # unlink all output files generated from this input
+                for handler, outputs in self._inputs[path]:
+                    handler.deleted(self._src_path, path)
+                    for out_path in outputs:
+                        self._clean_output(out_path)
+                del self._inputs[path]
+
+    def _dispatch(self, updated):
+        """Finds the handlers of every updated file and prepares their
+        outputs, returning a dict that maps every (handler, path) that needs
+        to be built to the most recent modification time of its inputs."""
+        builds = {}
         for path in sorted(updated, key=len):
             if not path.endswith(os.sep):
-                # if a previous version of the file was handled, remove all of
-                # its outputs (and their folders, where possible)
-                if path in self._inputs:
-                    for handler, outputs in self._inputs[path]:
-                        for out_path in outputs:
-                            self._clean_output(out_path)
-
                 # generate a list of all the handlers that can process the
-                # current version of this file; for each handler, ensure that
-                # it may safely output the files it's asking for
-                self._inputs[path] = []
-                for handler in self._handlers:
+                # current version of this file
+                path = paths.intern(path)
+                entries = []
+                for handler in self._dispatcher.candidates(path):
                     outputs = handler.handles(self._src_path, path)
                     if outputs is not None:
-                        self._inputs[path].append((handler, outputs))
-                        for out_path in outputs:
-                            self._prepare_output(out_path)
+                        entries.append((handler, tuple(
+                            paths.intern(out_path) for out_path in outputs)))
+
+                # if a previous version of the file was handled, remove all of
+                # its outputs (and their folders, where possible); handlers
+                # that compare digests keep the outputs they will produce
+                # again, as they may turn out to be up to date
+                keep = set(out_path for handler, outputs in entries
+                           if handler.digest for out_path in outputs)
+                for handler, outputs in self._inputs.get(path, ()):
+                    for out_path in outputs:
+                        if out_path not in keep:
+                            self._clean_output(out_path)
+
+                # for each handler, ensure that it may safely output the files
+                # it's asking for
+                self._inputs[path] = tuple(entries)
+                for handler, outputs in entries:
+                    for out_path in outputs:
+                        self._prepare_output(out_path)
 
                 if self._inputs[path]:
-                    # file can be processed by at least one handler
+                    # file can be processed by at least one handler; collect
+                    # what needs to be built, merging files that are reached
+                    # via more than one path (e.g. tree roots that share a
+                    # parent) so that they are only built once
                     for handler, outputs in self._inputs[path]:
-                        handler.changed(self._src_path, path, self._dest_path)
+                        targets = handler.targets(self._src_path, path)
+                        for target, mtime in targets.items():
+                            key = handler, target
+                            builds[key] = max(mtime, builds.get(key, mtime))
                 else:
                     # no handlers accept the current version of this file
                     del self._inputs[path]
 
-        for path in sorted(deleted, key=len, reverse=True):
-            if path in self._inputs:
-                # unlink all output files generated from this input
-                for handler, outputs in self._inputs[path]:
-                    handler.deleted(self._src_path, path)
+        # roots that are built because of the files they include need their
+        # output folders just as much
+        dispatched = set(updated)
+        for handler, target in builds:
+            if target not in dispatched:
+                for out_path in handler._outputs(self._src_path, target):
+                    self._prepare_output(out_path)
+        return builds
+
+    def _priority(self, handler, targets):
+        """Returns the priority of the task that builds `targets` (see
+        `Scheduler`): the handler's own, plus a head start for files that were
+        just edited, as someone is most likely waiting for those."""
+        age = time.time() - max(targets.values())
+        return handler.priority + max(0.0, self.RECENT - age)
+
+    def want(self, output):
+        """Asks for `output`, a path relative to the output folder, to be
+        built before anything else in the current batch. Returns whether it
+        was still waiting to be built."""
+        path = os.path.normcase(os.path.normpath(output))
+        with self._lock:
+            task = self._producers.get(path)
+        return task is not None and self._scheduler.promote(task)
+
+    def wait(self, output, timeout=None):
+        """Blocks until `output`, a path relative to the output folder, is up
+        to date: until neither the current batch nor the source changes that
+        were seen since may still build it (see `_outdated`). It is built
+        before anything else in the mean time (see `want`). Returns False if
+        that didn't happen within `timeout` seconds."""
+        path = os.path.normcase(os.path.normpath(output))
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while True:
+                task = self._producers.get(path)
+                if task is None and not self._outdated(path):
+                    return True
+
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if task is not None:
+                    self._scheduler.promote(task)
+                # the collector doesn't tell when it starts collecting
+                self._built.wait(min(0.05, remaining or 0.05))
+
+    def _outdated(self, output):
+        """Returns whether source changes were seen that weren't dispatched
+        yet, and that lead to `output` through the `targets` of a handler;
+        must be called with the lock held."""
+        changes = self._collector.pending(self._dispatched)
+        if changes is None:
+            # whatever is being collected may lead anywhere
+            return True
+
+        for change in changes:
+            if output.startswith(os.path.join(change, "")):
+                # a whole folder changed
+                return True
+            for handler in self._dispatcher.candidates(change):
+                try:
+                    targets = handler._targets(change)
+                except (KeyError, RuntimeError):
+                    # the batch is changing the handler's references
+                    return True
+                for target in targets:
+                    if output in handler._outputs(self._src_path, target):
+                        return True
+        return False
+
+    def _tracked(self, outputs, build):
+        """Wraps `build` so that `outputs` stop being waited for (see `wait`)
+        once it completes."""
+        def task():
+            try:
+                build()
+            finally:
+                with self._lock:
                     for out_path in outputs:
-                        self._clean_output(out_path)
-                del self._inputs[path]
+                        if self._producers.get(out_path) is task:
+                            del self._producers[out_path]
+                    self._built.notify_all()
+        return task
+
+    def _build_task(self, handler, path, mtime):
+        def build(targets):
+            for path, mtime in targets.items():
+                handler._build(self._src_path, path, self._dest_path, mtime)
+        return self._cancellable(handler, {path: mtime}, build)
+
+    def _batch_task(self, handler, targets):
+        def build(targets):
+            handler._build_many(self._src_path, targets, self._dest_path)
+        return self._cancellable(handler, targets, build)
+
+    def _cancellable(self, handler, targets, build):
+        """Wraps `build`, which is called with `targets` (a dict that maps
+        paths to their mtime), so that it runs with the snapshot of the
+        current batch and is cancelled as soon as any of their sources are
+        changed again. The targets that are still there are then cleaned and
+        built again right away, in the same task."""
+        current = self._snapshot
+
+        def task():
+            remaining = targets
+            with snapshot.scope(current):
+                if self._once:
+                    # nothing would notice changes while the batch runs
+                    build(remaining)
+                    remaining = None
+                while remaining:
+                    sources = set()
+                    for path in remaining:
+                        sources.update(handler._sources(self._src_path, path))
+                    token = cancel.Token()
+                    with self._lock:
+                        self._running[token] = sources
+                    try:
+                        with cancel.scope(token):
+                            build(remaining)
+                    finally:
+                        with self._lock:
+                            del self._running[token]
+                    if not token.cancelled:
+                        break
+
+                    # whatever the cancelled build left behind is obsolete;
+                    # the output folders are kept for the next attempt
+                    trace.count("builds restarted")
+                    for path in remaining:
+                        for out_path in handler._outputs(self._src_path,
+                                                         path):
+                            self._clean_output(out_path, folders=False)
+                    remaining = dict(
+                        (path, mtime) for path, mtime in remaining.items()
+                        if os.path.exists(os.path.join(self._src_path, path)))
+        return task
+
+    def _interrupt(self, paths):
+        """Cancels the running builds that any of `paths` is a source of."""
+        with self._lock:
+            if not self._running:
+                return
+            tokens = [token for token, sources in self._running.items()
+                      if not sources.isdisjoint(paths)]
+        for token in tokens:
+            token.cancel()
 
     def _batch(self, src_updated, src_deleted, dest_updated, dest_deleted):
+        # up to date checks use the mtimes that the batch was collected with;
+        # only the files that were written since then are stat'ed again
+        previous = self._snapshot
+        scanned = self._collector.scanned
+        written = {} if previous is None else dict(
+            (path, when) for path, when in previous.written.items()
+            if when >= scanned)
+        self._snapshot = snapshot.Snapshot([
+            (self._src_path, self._collector.files[0]),
+            (self._dest_path, self._collector.files[1])
+        ], scanned, written)
+        with snapshot.scope(self._snapshot):
+            self._run_batch(src_updated, src_deleted, dest_updated,
+                            dest_deleted)
+
+    def _run_batch(self, src_updated, src_deleted, dest_updated,
+                   dest_deleted):
         try:
-            if self._initial:
+            if self._initial and not self._restored:
                 # the first run will yield all pre-existing files; we don't
                 # want to delete any output files before we know whether we
                 # actually need them or not
                 self._batch_src(src_updated, src_deleted)
                 self._batch_dest(dest_updated, dest_deleted)
-                self._initial = False
-                if self._once:
-                    self.stop()
             else:
+                if self._initial:
+                    # outputs that were deleted while we weren't running won't
+                    # be rebuilt unless their inputs are considered changed
+                    src_updated = self._restore_outputs(src_updated,
+                                                        dest_deleted)
+                    src_updated = self._retry_errors(src_updated)
+
                 # after the initial batch is complete and we have a list of
                 # outputs, we'll delete first and ask questions later
                 self._batch_dest(dest_updated, dest_deleted)
                 self._batch_src(src_updated, src_deleted)
 
+            with trace.span("flush"):
+                for handler in self._handlers:
+                    handler.flush()
+                if self._cache is not None:
+                    self._cache.flush()
+                if self._state and (
+                        self._initial or src_updated or src_deleted or
+                        dest_deleted or any(path not in self._outputs for
+                                            path in dest_updated)):
+                    # batches that only saw outputs being written by the
+                    # previous one don't change anything worth saving
+                    self._save_state()
+            paths.table.prune()
+            trace.flush()
+
+            if self._initial:
+                self._initial = False
+                if self._once:
+                    self.stop()
+
         except Exception:
             logging.exception("Run-time error")
+            self._crashed = True
             self.stop()
+
+    def _restore_outputs(self, updated, deleted):
+        sources = {}
+        optional = set()  # outputs that builds may not have produced
+        for path, entries in self._inputs.items():
+            for handler, outputs in entries:
+                for out_path in outputs:
+                    sources[out_path] = path
+                if handler.optional and \
+                        len(outputs) == len(handler.suffixes):
+                    optional.update(out_path for out_path, suffix in
+                                    zip(outputs, handler.suffixes)
+                                    if suffix in handler.optional)
+
+        # outputs that were created after the state was saved aren't reported
+        # as deleted by the scan; they're simply missing, unless their build
+        # decided not to produce them
+        files = self._collector.files[1]
+        deleted = set(deleted)
+        deleted.update(path for path in sources
+                       if path not in files and path not in optional)
+
+        updated = list(updated)
+        seen = set(updated)
+        for path in deleted:
+            if path in sources and sources[path] not in seen:
+                seen.add(sources[path])
+                updated.append(sources[path])
+        return updated
+
+    def _retry_errors(self, updated):
+        """Adds the files that handlers had errors with (see
+        `Handler.errors`) to `updated`, as they may have been fixed by
+        changes to other files in the mean time."""
+        files = self._collector.files[0]
+        updated = list(updated)
+        seen = set(updated)
+        for handler in self._handlers:
+            for path in handler.errors:
+                if path not in seen and files.get(path) is not None:
+                    seen.add(path)
+                    updated.append(path)
+        return updated
+
+    def _save_state(self):
+        handlers = dict((handler, i) for i, handler in
+                        enumerate(self._handlers))
+        state = {
+            "version": self.STATE_VERSION,
+            "src": self._src_path,
+            "dest": self._dest_path,
+            "handlers": [handler._signature() for handler in self._handlers],
+            "src_files": self._collector.files[0].dump(),
+            "dest_files": self._collector.files[1].dump(),
+            "inputs": dict((path, [[handlers[handler], outputs]
+                                   for handler, outputs in entries])
+                           for path, entries in self._inputs.items()),
+            "outputs": sorted(self._outputs),
+            "handler_state": [handler.dump_state() for handler in
+                              self._handlers],
+            "digests": digest.cache.dump(self._src_path)
+        }
+        try:
+            atomic_write(self._state, json.dumps(state).encode("utf-8"))
+        except EnvironmentError as e:
+            logging.warning("Unable to save build state to '{0}': "
+                            "{1}".format(self._state, e))
+
+    def _load_state(self):
+        try:
+            with open(self._state, "rb") as f:
+                state = json.loads(f.read().decode("utf-8"))
+        except EnvironmentError:
+            # no previous state; this is a cold start
+            return
+        except ValueError:
+            logging.warning("Build state in '{0}' is corrupt; rescanning "
+                            "everything".format(self._state))
+            return
+
+        try:
+            if \
+                    state["version"] != self.STATE_VERSION or \
+                    state["src"] != self._src_path or \
+                    state["dest"] != self._dest_path or \
+                    state["handlers"] != [handler._signature() for handler in
+                                          self._handlers]:
+                logging.info("Build state in '{0}' is stale; rescanning "
+                             "everything".format(self._state))
+                return
+
+            src_files = scanner.load(state["src_files"])
+            dest_files = scanner.load(state["dest_files"])
+            inputs = dict((paths.intern(path), tuple(
+                (self._handlers[i], tuple(paths.intern(out_path)
+                                          for out_path in outputs))
+                for i, outputs in entries
+            )) for path, entries in state["inputs"].items())
+            outputs = dict((paths.intern(path), True)
+                           for path in state["outputs"])
+            digest.cache.load(state["digests"])
+            if len(state["handler_state"]) != len(self._handlers):
+                raise ValueError("Expected the state of {0} handlers".format(
+                    len(self._handlers)))
+
+            # either every handler gets its saved state or none of them does
+            previous = [handler.dump_state() for handler in self._handlers]
+            try:
+                for handler, handler_state in zip(self._handlers,
+                                                  state["handler_state"]):
+                    handler.load_state(handler_state)
+            except Exception:
+                for handler, handler_state in zip(self._handlers, previous):
+                    handler.load_state(handler_state)
+                raise
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logging.warning("Build state in '{0}' is corrupt; rescanning "
+                            "everything: {1!r}".format(self._state, e))
+            return
+
+        self._collector.src_proxy.files = src_files
+        self._collector.dest_proxy.files = dest_files
+        self._inputs = inputs
+        self._outputs = outputs
+        self._restored = True
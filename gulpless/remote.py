@@ -0,0 +1,428 @@
+# coding=utf-8
+"""Runs builds on other machines (or just other processes). A coordinator
+sends jobs to `gulpless worker` processes, which load the same `build.py`, over
+TCP or Unix sockets. Messages are framed as in `gulpless.workers`; some of them
+are followed by raw file contents:
+
+* `{"id": n, "handler": signature, "path": path, "sources": [[path, size],
+  ...], "outputs": [path, ...]}` is followed by the contents of every source,
+  in order. The worker builds `path` with the handler whose `_signature()` is
+  `signature`, in a temporary folder that only contains the sources.
+* For every output the build produced, the worker replies with `{"id": n,
+  "output": path, "size": size}` followed by its contents, then with `{"id":
+  n}` if the build succeeded, `{"id": n, "error": "message"}` if it failed, or
+  `{"id": n, "refused": "message"}` if it can't run the job at all (e.g. it
+  doesn't know the handler).
+* `{"id": n, "ping": true}` is answered with `{"id": n}`.
+
+Builds only see the files returned by their handler's `_sources`, so handlers
+that read anything else (e.g. imports that aren't declared in the file tree)
+should not be run remotely.
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.workers import read_frame, write_frame
+from gulpless.helpers import atomic_replace
+from gulpless import cancel
+from gulpless import trace
+
+import threading
+import termcolor
+import tempfile
+import logging
+import shutil
+import socket
+import json
+import time
+import os
+
+try:
+    import socketserver as _socketserver
+except ImportError:
+    import SocketServer as _socketserver
+
+
+__all__ = ["RemoteExecutor", "listen", "parse_address"]
+
+
+def parse_address(address):
+    """Returns the (host, port) tuple of a `host:port` string, or `address`
+    itself if it's the path of a Unix socket."""
+    if os.sep in address or "/" in address or ":" not in address:
+        return address
+    host, port = address.rsplit(":", 1)
+    return host.strip("[]"), int(port)
+
+
+class _Unavailable(EnvironmentError):
+    """Raised when a worker can't be reached or drops the connection."""
+
+
+def _copy(source, target, size):
+    """Copies exactly `size` bytes from the binary stream `source` to `target`
+    (or discards them, if it's None)."""
+    while size:
+        chunk = source.read(min(size, 1 << 20))
+        if not chunk:
+            raise EnvironmentError("Unexpected end of stream")
+        if target is not None:
+            target.write(chunk)
+        size -= len(chunk)
+
+
+class _Connection(object):
+    def __init__(self, address, timeout, build_timeout):
+        super(_Connection, self).__init__()
+
+        if isinstance(address, tuple):
+            self._socket = socket.create_connection(address, timeout)
+            # builds may take a while; notice workers that went away anyway
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(address)
+        self._file = self._socket.makefile("rwb")
+        self._timeout = timeout
+        self._build_timeout = build_timeout
+        self.requests = 0  # how many requests were completed
+        self._id = 0
+
+    def close(self):
+        for closeable in (self._file, self._socket):
+            try:
+                closeable.close()
+            except EnvironmentError:
+                pass
+
+    def request(self, message, sources, outputs):
+        """Sends a job `message` along with `sources`, a list of (path, file,
+        size) tuples, and returns the final reply. The outputs it receives are
+        written to `outputs`, a dict that maps relative to absolute paths, if
+        the build succeeds; the ones that weren't produced are removed."""
+        self._id += 1
+        message = dict(message, id=self._id,
+                       sources=[[path, size] for path, f, size in sources])
+        temps = {}
+        try:
+            # if the build is cancelled, the worker is left to finish it on
+            # its own
+            with cancel.watch(self._shutdown):
+                write_frame(self._file, message)
+                for path, f, size in sources:
+                    f.seek(0)
+                    _copy(f, self._file, size)
+                self._file.flush()
+
+                # the first reply only arrives once the build is done
+                self._socket.settimeout(self._build_timeout)
+                while True:
+                    reply = read_frame(self._file)
+                    self._socket.settimeout(self._timeout)
+                    if reply is None or reply.get("id") != self._id:
+                        raise _Unavailable("Connection closed")
+                    if "output" not in reply:
+                        break
+
+                    target = outputs.get(reply["output"])
+                    if target is None:
+                        raise _Unavailable("Unexpected output '{0}'".format(
+                            reply["output"]))
+                    fd, temps[target] = tempfile.mkstemp(
+                        prefix=os.path.basename(target) + ".",
+                        dir=os.path.dirname(target))
+                    with os.fdopen(fd, "wb") as f:
+                        _copy(self._file, f, reply["size"])
+        except (EnvironmentError, ValueError) as e:
+            for temp in temps.values():
+                os.unlink(temp)
+            cancel.check()
+            if isinstance(e, _Unavailable):
+                raise
+            raise _Unavailable("{0}".format(e) or type(e).__name__)
+
+        if "error" in reply or "refused" in reply:
+            for temp in temps.values():
+                os.unlink(temp)
+        else:
+            for target in outputs.values():
+                if target in temps:
+                    atomic_replace(temps[target], target)
+                elif os.path.exists(target):
+                    os.unlink(target)
+        self.requests += 1
+        return reply
+
+    def _shutdown(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except EnvironmentError:
+            pass
+
+
+class _Remote(object):
+    def __init__(self, address, timeout, build_timeout):
+        """A worker listening on `address`, and what we know about it."""
+        super(_Remote, self).__init__()
+
+        self.address = address
+        self.name = address if not isinstance(address, tuple) else \
+            "{0}:{1}".format(*address)
+        self.timeout = timeout
+        self.build_timeout = build_timeout
+        self.running = 0  # how many of our jobs it's running
+        self.failures = 0  # how many times in a row it couldn't be reached
+        self.down_until = 0  # when it may be tried again
+
+        self._lock = threading.Lock()
+        self._idle = []  # connections that aren't sending any job
+
+    def build(self, message, sources, outputs):
+        """Runs a job (see `_Connection.request`) on an idle connection, or a
+        new one if there is none, and returns the final reply."""
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                try:
+                    connection = _Connection(self.address, self.timeout,
+                                             self.build_timeout)
+                except EnvironmentError as e:
+                    raise _Unavailable("{0}".format(e))
+
+            try:
+                reply = connection.request(message, sources, outputs)
+            except _Unavailable:
+                connection.close()
+                if connection.requests:
+                    # the worker was probably restarted since this
+                    # connection was last used; try a new one
+                    continue
+                raise
+            except Exception:
+                # e.g. the build was cancelled halfway through
+                connection.close()
+                raise
+
+            with self._lock:
+                self._idle.append(connection)
+            return reply
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class RemoteExecutor(object):
+    def __init__(self, addresses, retries=1, fallback=True, timeout=10,
+                 build_timeout=None, backoff=60):
+        """Runs builds on the `gulpless worker` processes that listen on
+        `addresses`, each either a `host:port` string or the path of a Unix
+        socket. Every job is sent to the healthy worker with the fewest of our
+        jobs; workers that can't be reached (or stall for more than `timeout`
+        seconds while a job or its outputs are being sent, or take more than
+        `build_timeout` seconds to build it, if that is not None) are skipped
+        for a second, then twice as long after every consecutive failure, up
+        to `backoff` seconds. Jobs are retried on up to `retries` other
+        workers; after that (or if no worker is healthy), they are built
+        locally if `fallback` is true."""
+        super(RemoteExecutor, self).__init__()
+
+        self.remotes = [_Remote(parse_address(address), timeout,
+                                build_timeout) for address in addresses]
+        self.retries = retries
+        self.fallback = fallback
+        self.backoff = backoff
+        self._lock = threading.Lock()
+
+    def build(self, handler, src, path, input_path, output_paths):
+        """Builds `path` out of the source folder `src` on one of the workers,
+        the same way `handler.build(input_path, output_paths)` would."""
+        outputs = dict(zip(handler._outputs(src, path), output_paths))
+        message = {"handler": handler._signature(), "path": path,
+                   "outputs": sorted(outputs)}
+
+        sources = []
+        try:
+            for source in handler._sources(src, path):
+                f = open(os.path.join(src, source), "rb")
+                sources.append((source, f, os.fstat(f.fileno()).st_size))
+
+            tried = []
+            for attempt in range(self.retries + 1):
+                remote = self._choose(tried)
+                if remote is None:
+                    break
+                tried.append(remote)
+
+                try:
+                    reply = remote.build(message, sources, outputs)
+                except _Unavailable as e:
+                    self._failed(remote, e)
+                    continue
+                finally:
+                    with self._lock:
+                        remote.running -= 1
+
+                with self._lock:
+                    remote.failures = 0
+                if "refused" in reply:
+                    logging.debug("{0} refused {1}: {2}".format(
+                        remote.name, path, reply["refused"]))
+                    continue
+                trace.count("remote builds")
+                if "error" in reply:
+                    raise EnvironmentError(reply["error"])
+                return
+        finally:
+            for source, f, size in sources:
+                f.close()
+
+        if not self.fallback:
+            raise EnvironmentError("No worker could build {0}".format(path))
+        trace.count("remote fallbacks")
+        handler.build(input_path, output_paths)
+
+    def close(self):
+        """Closes every idle connection."""
+        for remote in self.remotes:
+            remote.close()
+
+    def _choose(self, tried):
+        now = time.time()
+        with self._lock:
+            candidates = [remote for remote in self.remotes if
+                          remote not in tried and remote.down_until <= now]
+            if not candidates:
+                return None
+            remote = min(candidates, key=lambda remote: remote.running)
+            remote.running += 1
+            return remote
+
+    def _failed(self, remote, error):
+        trace.count("remote failures")
+        with self._lock:
+            remote.failures += 1
+            delay = min(self.backoff, 2 ** (remote.failures - 1))
+            remote.down_until = time.time() + delay
+        logging.warning("Skipping worker {0} for {1}s: {2}".format(
+            termcolor.colored(remote.name, "yellow", attrs=["bold"]),
+            delay, error.args[0] if error.args else error))
+
+
+class _JobHandler(_socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = read_frame(self.rfile)
+            except (EnvironmentError, ValueError):
+                break
+            if request is None:
+                break
+
+            if "ping" in request:
+                write_frame(self.wfile, {"id": request["id"]})
+            else:
+                self._run(request)
+
+    def _run(self, request):
+        reply = {"id": request["id"]}
+        folder = tempfile.mkdtemp(prefix="gulpless-job-")
+        try:
+            src = os.path.join(folder, "src")
+            dest = os.path.join(folder, "dest")
+            valid = all(_relative(path) for path in
+                        [request["path"]] + request["outputs"] +
+                        [path for path, size in request["sources"]])
+
+            # the contents of the sources must be read in any case
+            for path, size in request["sources"]:
+                if not valid:
+                    _copy(self.rfile, None, size)
+                    continue
+                target = os.path.join(src, path)
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                with open(target, "wb") as f:
+                    _copy(self.rfile, f, size)
+
+            handler = self.server.handlers.get(json.dumps(request["handler"]))
+            if not valid:
+                reply["refused"] = "Invalid path"
+            elif handler is None:
+                reply["refused"] = "Unknown handler"
+            else:
+                self._build(handler, request, reply, src, dest)
+            write_frame(self.wfile, reply)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def _build(self, handler, request, reply, src, dest):
+        output_paths = [os.path.join(dest, path) for path in
+                        request["outputs"]]
+        for output in output_paths:
+            if not os.path.isdir(os.path.dirname(output)):
+                os.makedirs(os.path.dirname(output))
+
+        start = time.time()
+        try:
+            with self.server.slots:
+                handler.build(os.path.join(src, request["path"]),
+                              output_paths)
+        except Exception as e:
+            reply["error"] = "{0}".format(e) or type(e).__name__
+            logging.error("{0} failed after {1:.2f}s: {2}".format(
+                termcolor.colored(request["path"], "red", attrs=["bold"]),
+                time.time() - start, reply["error"]))
+            return
+
+        logging.info("{0} built in {1:.2f}s".format(
+            termcolor.colored(request["path"], "green", attrs=["bold"]),
+            time.time() - start))
+        for path, output in zip(request["outputs"], output_paths):
+            if os.path.isfile(output):
+                with open(output, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    write_frame(self.wfile, {"id": request["id"],
+                                             "output": path, "size": size})
+                    _copy(f, self.wfile, size)
+
+
+def _relative(path):
+    """Returns whether `path` is a relative path inside its folder."""
+    path = os.path.normpath(path)
+    return not os.path.isabs(path) and path != os.pardir and \
+        not path.startswith(os.pardir + os.sep)
+
+
+class _TCPServer(_socketserver.ThreadingMixIn, _socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(_socketserver, "UnixStreamServer"):
+    class _UnixServer(_socketserver.ThreadingMixIn,
+                      _socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def listen(address, handlers, jobs=1):
+    """Returns a server that runs the jobs it receives on `address` (see
+    `parse_address`) with `handlers`, at most `jobs` at the same time. Call
+    its `serve_forever` method to start it."""
+    address = parse_address(address) if not isinstance(address, tuple) \
+        else address
+    if isinstance(address, tuple):
+        server = _TCPServer(address, _JobHandler)
+    else:
+        if os.path.exists(address):
+            # left behind by a previous worker
+            os.unlink(address)
+        server = _UnixServer(address, _JobHandler)
+
+    server.handlers = dict((json.dumps(handler._signature()), handler) for
+                           handler in handlers)
+    server.slots = threading.Semaphore(max(1, jobs))
+    return server
@@ -0,0 +1,356 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.scheduler import Scheduler
+from gulpless.paths import intern
+from gulpless import trace
+
+import time
+import os
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+# folders map the names of their files to their modification time, and the
+# names of their subfolders to one of these
+FOLDER, LINK = object(), object()
+
+
+class Scanner(object):
+    def __init__(self, path, jobs=4, scheduler=None):
+        """Creates a new scanner for the tree rooted at `path`. Every scan
+        reports the files and folders that were created, changed or deleted
+        since the previous one. Folders whose modification time didn't change
+        are not listed again (only their files are checked) and the top level
+        folders of the tree are scanned by up to `jobs` threads at once. If
+        `scheduler` is not None, it runs those scans instead, and `jobs` is
+        ignored; it may be shared with other scanners, and its owner stops
+        it. Otherwise, the threads are stopped after every scan."""
+        super(Scanner, self).__init__()
+
+        self.path = path
+        self._scheduler = scheduler or Scheduler(jobs)
+        self._own_scheduler = scheduler is None
+        # maps a folder to its mtime, its entries and the snapshot they belong
+        # to; entries that belong to an older snapshot are copied on write
+        self._folders = {"": [None, {}, None]}
+        self._snapshot = object()
+
+    @property
+    def files(self):
+        """A `Files` mapping of every known path to its modification time, as
+        of the last scan. Later scans don't change it."""
+        self._snapshot = object()
+        return Files(dict(self._folders))
+
+    @files.setter
+    def files(self, files):
+        # the mtimes of the folders are not known, so every folder will be
+        # listed during the next scan
+        self._folders = dict((folder, [None, entries, None]) for folder, (
+            mtime, entries, snapshot) in files._folders.items())
+        self._folders.setdefault("", [None, {}, None])
+        self._snapshot = object()
+
+    def scan(self, roots=None, folders=()):
+        """Scans the tree and returns a (changed, deleted) tuple. If `roots` is
+        not None, only those paths (and their contents) are scanned, along with
+        the entries of every folder in `folders`."""
+        changed, deleted = [], []
+        if roots is None:
+            self._scan_root(changed, deleted)
+            return changed, deleted
+
+        for folder in sorted(folders, key=len):
+            if folder not in self._folders:
+                # unknown folders are scanned along with their contents
+                roots = set(roots)
+                roots.add(folder)
+            else:
+                pending, new = self._scan_folder(folder, changed, deleted,
+                                                 True, False)
+                for path in new:
+                    self._scan_folder(path, changed, deleted, True, True)
+
+        for root in sorted(roots, key=len):
+            abspath = os.path.join(self.path, root)
+            try:
+                isdir = os.path.isdir(abspath)
+                exists = isdir or os.path.exists(abspath)
+            except EnvironmentError:
+                isdir = exists = False
+
+            if not root:
+                self._scan_folder(root, changed, deleted, True, True)
+            elif not exists:
+                self._forget(root, deleted)
+            elif isdir:
+                if _isfile(_get(self._folders, root)):
+                    self._forget(root, deleted)
+                self._add_folder(root, FOLDER, changed)
+                self._scan_folder(root, changed, deleted, True, True)
+            else:
+                if _isdir(_get(self._folders, root)):
+                    self._forget(root, deleted)
+                self._visit(root, abspath, changed, deleted)
+                trace.count("files scanned")
+                trace.count("stat calls")
+        return changed, deleted
+
+    def _entry(self, folder):
+        """Returns the entry of `folder`, ready to be modified."""
+        entry = self._folders.get(folder)
+        if entry is None:
+            entry = self._folders[folder] = [None, {}, self._snapshot]
+        elif entry[2] is not self._snapshot:
+            # shared with an older snapshot
+            entry = self._folders[folder] = [entry[0], dict(entry[1]),
+                                             self._snapshot]
+        return entry
+
+    def _scan_root(self, changed, deleted):
+        # the top level folders are scanned in parallel; each one of them has
+        # its own list of changes
+        pending, new = self._scan_folder("", changed, deleted, False, False)
+        subfolders = pending + new
+        results = [([], []) for folder in subfolders]
+        try:
+            self._scheduler.run(self._task(folder, result) for folder, result
+                                in zip(subfolders, results))
+        finally:
+            if self._own_scheduler:
+                self._scheduler.stop()
+        for folder_changed, folder_deleted in results:
+            changed.extend(folder_changed)
+            deleted.extend(folder_deleted)
+
+    def _task(self, folder, result):
+        return lambda: self._scan_folder(folder, result[0], result[1], False,
+                                         True)
+
+    def _scan_folder(self, folder, changed, deleted, force, recurse):
+        """Scans the entries of `folder`. If `force` is false and the
+        modification time of the folder didn't change, it is not listed again.
+        If `recurse` is true, subfolders are scanned as well; otherwise, a
+        (known, new) tuple of subfolder lists is returned."""
+        abspath = os.path.join(self.path, folder)
+        try:
+            stat = os.stat(abspath)
+        except EnvironmentError:
+            if folder:
+                self._forget(folder, deleted)
+            return [], []
+
+        mtime = _mtime_ns(stat)
+        entry = self._folders.get(folder)
+        if entry is None:
+            entry = self._entry(folder)
+
+        pending, new = [], []
+        scanned, stats = 0, 1
+        if not force and entry[0] == mtime:
+            # no entries were added or removed; only check the files
+            for name, value in list(entry[1].items()):
+                path = os.path.join(folder, name)
+                scanned += 1
+                if _isfile(value):
+                    stats += 1
+                    self._visit(path, os.path.join(abspath, name), changed,
+                                deleted)
+                elif value is FOLDER:
+                    pending.append(path)
+        else:
+            if time.time() - stat.st_mtime < 2:
+                # the folder may still be changed in the same timestamp
+                # granularity; don't trust its mtime during the next scan
+                mtime = None
+
+            try:
+                iterator = os.scandir(abspath)
+            except EnvironmentError:
+                if folder:
+                    self._forget(folder, deleted)
+                return [], []
+
+            entry = self._entry(folder)
+            names = set()
+            with iterator:
+                for item in iterator:
+                    name = os.path.normcase(item.name)
+                    path = os.path.join(folder, name)
+                    try:
+                        if item.is_dir():
+                            kind = LINK if item.is_symlink() else FOLDER
+                        else:
+                            kind = None  # a file
+                    except EnvironmentError:
+                        continue
+
+                    previous = entry[1].get(name)
+                    if previous is not None and \
+                            _isdir(previous) != (kind is not None):
+                        # changed from / to folder
+                        self._forget(path, deleted)
+                        previous = None
+
+                    names.add(name)
+                    scanned += 1
+                    if kind is None:
+                        stats += 1
+                        try:
+                            self._update(path, item.stat().st_mtime, changed)
+                        except EnvironmentError:
+                            self._forget(path, deleted)
+                            names.discard(name)
+                    elif previous is None:
+                        self._add_folder(path, kind, changed)
+                        if kind is FOLDER:
+                            new.append(path)
+                    else:
+                        entry[1][name] = kind
+                        if kind is FOLDER:
+                            pending.append(path)
+
+            for name in set(entry[1]) - names:
+                self._forget(os.path.join(folder, name), deleted)
+            entry[0] = mtime
+
+        trace.count("files scanned", scanned)
+        trace.count("stat calls", stats)
+        if not recurse:
+            return pending, new
+        for path in pending + new:
+            self._scan_folder(path, changed, deleted, force, True)
+        return [], []
+
+    def _visit(self, path, abspath, changed, deleted):
+        try:
+            self._update(path, os.path.getmtime(abspath), changed)
+        except EnvironmentError:
+            # in 99% of the cases the file has been deleted while iterating
+            # the parent folder; if the file was previously being handled,
+            # then stop handling it; otherwise ignore
+            self._forget(path, deleted)
+
+    def _update(self, path, mtime, changed):
+        folder, name = os.path.split(path)
+        entry = self._folders.get(folder)
+        if entry is None or entry[1].get(name) != mtime:
+            # file is new or has been changed since last check (possibly
+            # replaced by an older version while we weren't looking)
+            self._entry(folder)[1][intern(name)] = mtime
+            changed.append(path)
+
+    def _add_folder(self, path, kind, changed):
+        folder, name = os.path.split(path)
+        entries = self._entry(folder)[1]
+        if not _isdir(entries.get(name)):
+            # don't really care about folder mtime
+            changed.append(path + os.sep)
+        entries[intern(name)] = kind
+        if kind is FOLDER and path not in self._folders:
+            self._folders[path] = [None, {}, self._snapshot]
+
+    def _forget(self, path, deleted):
+        """Forgets about the file or folder `path` and everything in it."""
+        folder, name = os.path.split(path)
+        entry = self._folders.get(folder)
+        value = None
+        if entry is not None and name in entry[1]:
+            value = self._entry(folder)[1].pop(name)
+        self._drop(path, value, deleted)
+
+    def _drop(self, path, value, deleted):
+        """Reports `path`, whose entry in its folder was `value`, and
+        everything in it as deleted."""
+        if _isfile(value):
+            deleted.append(path)
+
+        entry = self._folders.pop(path, None)
+        if entry is not None:
+            for name, child in entry[1].items():
+                self._drop(os.path.join(path, name), child, deleted)
+        if _isdir(value):
+            deleted.append(path + os.sep)
+
+
+class Files(Mapping):
+    def __init__(self, folders):
+        """A read-only mapping of every path of a tree to its modification
+        time, as returned by `Scanner.files`. Folder paths end with a
+        separator and are always mapped to 0. Only the names of the entries of
+        every folder are kept; full paths are built as they're iterated."""
+        super(Files, self).__init__()
+        self._folders = folders
+
+    def __getitem__(self, path):
+        value = self.get(path)
+        if value is None:
+            raise KeyError(path)
+        return value
+
+    def get(self, path, default=None):
+        # called for every up to date check (see `gulpless.snapshot`), so it
+        # doesn't go through `__getitem__`
+        if path.endswith(os.sep):
+            if _isdir(_get(self._folders, path[:-1])):
+                return 0
+        else:
+            value = _get(self._folders, path)
+            if _isfile(value):
+                return value
+        return default
+
+    def __iter__(self):
+        for folder, entry in self._folders.items():
+            for name, value in entry[1].items():
+                path = os.path.join(folder, name)
+                yield path + os.sep if _isdir(value) else path
+
+    def __len__(self):
+        return sum(len(entry[1]) for entry in self._folders.values())
+
+    def dump(self):
+        """Returns the paths in a JSON-serializable format: a dict that maps
+        every folder to a dict of its entries, the names of subfolders ending
+        with a separator (see `load`)."""
+        return dict((folder, dict(
+            (name + os.sep, 0) if _isdir(value) else (name, value)
+            for name, value in entry[1].items()
+        )) for folder, entry in self._folders.items())
+
+
+def load(folders):
+    """Returns the `Files` that were dumped to `folders`."""
+    result = {}
+    for folder, entries in folders.items():
+        folder = intern(folder)
+        result[folder] = [None, dict(
+            (intern(name[:-1]), FOLDER) if name.endswith(os.sep) else
+            (intern(name), float(mtime)) for name, mtime in entries.items()
+        ), None]
+    return Files(result)
+
+
+def _get(folders, path):
+    """Returns the entry of `path` in its folder, or None."""
+    folder, _, name = path.rpartition(os.sep)
+    entry = folders.get(folder)
+    return None if entry is None else entry[1].get(name)
+
+
+def _isdir(value):
+    return value is FOLDER or value is LINK
+
+
+def _isfile(value):
+    return value is not None and value is not FOLDER and value is not LINK
+
+
+def _mtime_ns(stat):
+    try:
+        return stat.st_mtime_ns
+    except AttributeError:
+        return int(stat.st_mtime * 10**9)
@@ -0,0 +1,159 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless import trace
+
+import itertools
+import threading
+import logging
+import heapq
+import time
+
+
+class Scheduler(object):
+    def __init__(self, jobs=1, aging=60, counter=None):
+        """Creates a new scheduler that runs at most `jobs` tasks at the same
+        time. Worker threads are only started when they are first needed; if
+        `jobs` is 1 (or there's a single task), tasks are run by the calling
+        thread instead. Tasks may have a priority: the number of seconds they
+        may overtake tasks that were queued before them, up to `aging`, so
+        that no task waits for ever behind tasks that keep being queued after
+        it. If `counter` is not None, the time tasks spend in the queue is
+        added to the trace counter of that name."""
+        super(Scheduler, self).__init__()
+
+        self.jobs = max(1, jobs)
+        self.aging = aging
+        self.counter = counter
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # anything changed
+        self._heap = []  # [key, sequence, task, pending, queued] entries
+        self._entries = {}  # maps queued tasks to their entry
+        self._sequence = itertools.count()
+        self._workers = []
+        self._busy = 0  # the number of tasks that are running
+        self._quit = 0  # the number of workers that must exit
+
+    def run(self, tasks):
+        """Runs every task in `tasks`, returning after all of them have
+        completed. Tasks are either callables or (priority, callable) tuples;
+        they are started in order of priority (see `Scheduler`), then in the
+        order they were given, but may complete in any order. Several threads
+        may call `run` at the same time; their tasks share the same queue and
+        the same limit of `jobs`."""
+        tasks = [task if isinstance(task, tuple) else (0, task)
+                 for task in tasks]
+        if not tasks:
+            return
+
+        pending = [len(tasks)]
+        now = time.time()
+        with self._lock:
+            for priority, task in tasks:
+                priority = max(-self.aging, min(priority, self.aging))
+                entry = [now - priority, next(self._sequence), task, pending,
+                         now]
+                self._entries[task] = entry
+                heapq.heappush(self._heap, entry)
+            self._changed.notify_all()
+
+            inline = self.jobs == 1 or len(tasks) == 1
+            while not inline and \
+                    len(self._workers) < min(self.jobs, len(tasks)):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+        if inline:
+            # the calling thread runs tasks itself, as long as no more than
+            # `jobs` of them are running across all threads
+            while True:
+                with self._lock:
+                    entry = self._next(lambda: not pending[0])
+                if entry is None:
+                    break
+                self._complete(entry)
+
+        with self._lock:
+            while pending[0]:
+                self._changed.wait()
+
+    def promote(self, task):
+        """Starts `task` before every other queued task, if it hasn't started
+        yet. Returns whether it was still queued."""
+        with self._lock:
+            entry = self._entries.get(task)
+            if entry is None:
+                return False
+
+            # the old entry is skipped once it reaches the top of the heap;
+            # the most recently promoted task goes first
+            promoted = [min(entry[0], self._heap[0][0]),
+                        -next(self._sequence)] + entry[2:]
+            entry[2] = None
+            self._entries[task] = promoted
+            heapq.heappush(self._heap, promoted)
+            return True
+
+    def stop(self):
+        """Stops all worker threads once they finish the queued tasks."""
+        with self._lock:
+            self._quit += len(self._workers)
+            self._workers = []
+            self._changed.notify_all()
+
+    def _pop(self):
+        """Returns the entry of the next task to start, or None if there are
+        none; must be called with the lock held."""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[2] is not None:
+                if self._entries.get(entry[2]) is entry:
+                    del self._entries[entry[2]]
+                return entry
+        return None
+
+    def _next(self, done):
+        """Waits for a task that may be started and returns its entry, or
+        None as soon as `done` returns true; must be called with the lock
+        held."""
+        while not done():
+            if self._busy < self.jobs:
+                entry = self._pop()
+                if entry is not None:
+                    self._busy += 1
+                    return entry
+            self._changed.wait()
+        return None
+
+    def _work(self):
+        def done():
+            # workers only quit once every queued task has started
+            return self._quit > 0 and not self._entries
+
+        while True:
+            with self._lock:
+                entry = self._next(done)
+                if entry is None:
+                    self._quit -= 1
+                    break
+            self._complete(entry)
+
+    def _complete(self, entry):
+        key, sequence, task, pending, queued = entry
+        if self.counter is not None:
+            trace.count(self.counter, time.time() - queued)
+        self._execute(task)
+        with self._lock:
+            self._busy -= 1
+            pending[0] -= 1
+            self._changed.notify_all()
+
+    def _execute(self, task):
+        try:
+            task()
+        except Exception:
+            # handlers are expected to deal with their own errors; anything
+            # that makes it this far is a bug, but shouldn't kill the worker
+            logging.exception("Run-time error")
@@ -0,0 +1,196 @@
+# coding=utf-8
+"""A development server for the output folder of a `Reactor`. Requests for
+outputs that are about to be (re)built are held until the build completes,
+so that stale or partially written files are never served. Precompressed
+`.gz` siblings are served to clients that accept them.
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+
+import mimetypes
+import threading
+import termcolor
+import logging
+import shutil
+import socket
+import errno
+import os
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit
+    from urllib import unquote
+
+
+__all__ = ["Server", "serve"]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "gulpless"
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def log_message(self, format, *args):
+        logging.debug("{0} - {1}".format(self.address_string(),
+                                         format % args))
+
+    def _serve(self, body):
+        path = self._resolve(self.path)
+        if path is None:
+            self.send_error(404)
+            return
+
+        reactor = self.server.reactor
+        if not reactor.wait(path, self.server.build_timeout):
+            logging.warning("{0} is still being built after {1}s; serving "
+                            "it anyway".format(termcolor.colored(
+                                path, "yellow", attrs=["bold"]),
+                                self.server.build_timeout))
+
+        filename = os.path.join(reactor._dest_path, path)
+        encoding = None
+        if _accepts(self.headers.get("Accept-Encoding", ""), "gzip"):
+            compressed = filename + ".gz"
+            try:
+                if os.path.getmtime(compressed) >= os.path.getmtime(filename):
+                    filename, encoding = compressed, "gzip"
+            except EnvironmentError:
+                # no (or no longer a) precompressed version
+                pass
+
+        try:
+            f = open(filename, "rb")
+        except EnvironmentError:
+            self.send_error(404)
+            return
+
+        with f:
+            stat = os.fstat(f.fileno())
+            tag = "\"{0:x}-{1:x}{2}\"".format(
+                int(stat.st_mtime * 1e6), stat.st_size,
+                "-gz" if encoding else "")
+            if tag in _tags(self.headers.get("If-None-Match", "")):
+                self.send_response(304)
+                self.send_header("ETag", tag)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            content_type, _ = mimetypes.guess_type(path)
+            self.send_header("Content-Type",
+                             content_type or "application/octet-stream")
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Content-Length", str(stat.st_size))
+            self.send_header("ETag", tag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            if body:
+                self._send(f, stat.st_size)
+
+    def _resolve(self, url):
+        """Returns the path relative to the output folder that `url` refers
+        to, or None if it is outside of it."""
+        path = unquote(urlsplit(url).path)
+        path = os.path.normcase(os.path.normpath(path.lstrip("/") or "."))
+        if path == os.pardir or path.startswith(os.pardir + os.sep) or \
+                os.path.isabs(path):
+            return None
+
+        dest = self.server.reactor._dest_path
+        if path == os.curdir or os.path.isdir(os.path.join(dest, path)):
+            path = os.path.normpath(os.path.join(path, "index.html"))
+        return path
+
+    def _send(self, f, size):
+        try:
+            self.wfile.flush()
+            if not _sendfile(self.connection, f, size):
+                shutil.copyfileobj(f, self.wfile, 1 << 20)
+        except EnvironmentError as e:
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                raise
+            # the client went away
+            self.close_connection = True
+
+
+def _sendfile(connection, f, size):
+    """Sends `size` bytes of `f` over `connection` without copying them to
+    user space, where possible. Returns False if it isn't."""
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is None:
+        return False
+
+    offset = 0
+    try:
+        while offset < size:
+            sent = sendfile(connection.fileno(), f.fileno(), offset,
+                            size - offset)
+            if not sent:
+                # the file was truncated in the mean time
+                break
+            offset += sent
+    except EnvironmentError as e:
+        if offset or e.errno not in (errno.EINVAL, errno.ENOSYS,
+                                     errno.ENOTSOCK):
+            raise
+        # this kind of socket (or file) doesn't support sendfile
+        return False
+    return True
+
+
+def _tags(header):
+    return [tag.strip() for tag in header.split(",")]
+
+
+def _accepts(header, encoding):
+    """Returns whether an Accept-Encoding `header` allows `encoding`; it
+    doesn't if its q-value (or that of `*`, if it isn't listed) is 0."""
+    weights = {}
+    for entry in header.split(","):
+        name, _, params = entry.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    return weights.get(encoding, weights.get("*", 0.0)) > 0
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, reactor, address=("localhost", 8000), timeout=60):
+        """Serves the output folder of `reactor` on `address`, waiting up to
+        `timeout` seconds for pending builds of the requested files."""
+        if ":" in address[0]:
+            self.address_family = socket.AF_INET6
+        HTTPServer.__init__(self, address, RequestHandler)
+        self.reactor = reactor
+        self.build_timeout = timeout
+
+
+def serve(reactor, address=("localhost", 8000), timeout=60):
+    """Starts a `Server` in a background thread and returns it; call its
+    `shutdown` method to stop it."""
+    server = Server(reactor, address, timeout)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logging.info("Serving {0} on http://{1}:{2}/".format(
+        reactor._dest_path, *server.server_address[:2]))
+    return server
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""The modification times that a batch was collected with. Every batch runs
+with a `Snapshot` of the scans that collected it, so that handlers can check
+whether outputs are up to date without hitting the filesystem again.
+
+Handlers call `getmtime` and `exists` instead of their `os.path`
+counterparts, and `wrote` with every file they write; files written after
+the scan (and files that it didn't see) are stat'ed as usual.
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+from gulpless import trace
+
+import contextlib
+import threading
+import time
+import os
+
+
+__all__ = ["Snapshot", "scope", "current", "getmtime", "exists", "isdir",
+           "wrote"]
+
+
+class Snapshot(object):
+    def __init__(self, trees, scanned, written=None):
+        """Creates a snapshot of `trees`, a list of (folder, files) tuples
+        where `files` is the `gulpless.scanner.Files` of `folder` as of
+        `scanned` (when its scan started). `written` maps files to when they
+        were last written (see `wrote`), possibly by the builds of an earlier
+        batch that were still running while it was scanned."""
+        super(Snapshot, self).__init__()
+
+        self.scanned = scanned
+        self.written = {} if written is None else written
+        self._trees = [(os.path.join(folder, ""), files) for folder, files in
+                       trees]
+
+    def getmtime(self, filename):
+        mtime = self._get(filename)
+        if mtime is None:
+            trace.count("stat calls")
+            mtime = os.path.getmtime(filename)
+        return mtime
+
+    def exists(self, filename):
+        if self._get(filename) is not None:
+            return True
+        trace.count("stat calls")
+        return os.path.exists(filename)
+
+    def isdir(self, filename):
+        if self._get(filename, os.sep) is not None:
+            return True
+        trace.count("stat calls")
+        return os.path.isdir(filename)
+
+    def wrote(self, filenames):
+        now = time.time()
+        for filename in filenames:
+            self.written[filename] = now
+
+    def _get(self, filename, suffix=""):
+        """Returns the mtime of `filename` (0 for folders, if `suffix` is a
+        separator) as of the scan, or None if it may be different by now."""
+        if self.written.get(filename, 0) >= self.scanned:
+            return None
+        for folder, files in self._trees:
+            if filename.startswith(folder):
+                return files.get(filename[len(folder):] + suffix)
+        return None
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def scope(snapshot):
+    """Makes `snapshot` the current snapshot of the calling thread within the
+    `with` block."""
+    previous = getattr(_local, "snapshot", None)
+    _local.snapshot = snapshot
+    try:
+        yield snapshot
+    finally:
+        _local.snapshot = previous
+
+
+def current():
+    """Returns the snapshot of the batch that runs in the calling thread, or
+    None if there is none."""
+    return getattr(_local, "snapshot", None)
+
+
+def getmtime(filename):
+    """Like `os.path.getmtime`, but answered by the current snapshot where
+    possible."""
+    snapshot = current()
+    if snapshot is None:
+        return os.path.getmtime(filename)
+    return snapshot.getmtime(filename)
+
+
+def exists(filename):
+    """Like `os.path.exists`, but answered by the current snapshot where
+    possible."""
+    snapshot = current()
+    if snapshot is None:
+        return os.path.exists(filename)
+    return snapshot.exists(filename)
+
+
+def isdir(filename):
+    """Like `os.path.isdir`, but answered by the current snapshot where
+    possible."""
+    snapshot = current()
+    if snapshot is None:
+        return os.path.isdir(filename)
+    return snapshot.isdir(filename)
+
+
+def wrote(filenames):
+    """Tells the current snapshot that `filenames` were just written (or
+    deleted), so that they are stat'ed again."""
+    snapshot = current()
+    if snapshot is not None:
+        snapshot.wrote(filenames)
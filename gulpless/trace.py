@@ -0,0 +1,184 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.helpers import atomic_write
+
+import threading
+import json
+import time
+import os
+
+
+__all__ = ["enable", "disable", "span", "count", "flush", "summary",
+           "add_sink", "remove_sink", "ChromeTrace"]
+
+
+# whether anything is recorded at all; when false, `span` and `count` return
+# right away so that instrumentation costs (next to) nothing
+enabled = False
+
+_lock = threading.Lock()
+_spans = {}  # maps span names to their [count, total, max] durations
+_counters = {}  # maps counter names to their total value
+_sinks = []  # functions that are called with every event
+_epoch = time.time()
+
+
+def enable():
+    """Starts recording spans and counters."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stops recording spans and counters."""
+    global enabled
+    enabled = False
+
+
+def add_sink(sink):
+    """Calls `sink` with every event that is recorded from now on. Events are
+    dicts in the Chrome trace event format (`ph` is `X` for spans and `C` for
+    counters), with timestamps in microseconds."""
+    with _lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    with _lock:
+        _sinks.remove(sink)
+
+
+class _Noop(object):
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_noop = _Noop()
+
+
+class _Span(object):
+    __slots__ = ["name", "args", "start"]
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.time()
+        duration = end - self.start
+        with _lock:
+            stats = _spans.get(self.name)
+            if stats is None:
+                stats = _spans[self.name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            sinks = list(_sinks)
+
+        if sinks:
+            event = {
+                "name": self.name,
+                "ph": "X",
+                "ts": (self.start - _epoch) * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.current_thread().ident,
+                "args": self.args
+            }
+            for sink in sinks:
+                sink(event)
+        return False
+
+
+def span(name, **args):
+    """Returns a context manager that records the time spent in its block
+    under `name`. `args` are attached to the trace event."""
+    if not enabled:
+        return _noop
+    return _Span(name, args)
+
+
+def count(name, value=1):
+    """Adds `value` to the counter `name`."""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def flush():
+    """Sends the current value of every counter to the sinks; called at the
+    end of every batch."""
+    if not enabled:
+        return
+    with _lock:
+        counters = dict(_counters)
+        sinks = list(_sinks)
+
+    timestamp = (time.time() - _epoch) * 1e6
+    for name, value in sorted(counters.items()):
+        event = {
+            "name": name,
+            "ph": "C",
+            "ts": timestamp,
+            "pid": os.getpid(),
+            "args": {"value": value}
+        }
+        for sink in sinks:
+            sink(event)
+
+
+def summary():
+    """Returns a table of every span and counter recorded so far."""
+    with _lock:
+        spans = dict((name, list(stats)) for name, stats in _spans.items())
+        counters = dict(_counters)
+
+    lines = ["{0:<24}{1:>10}{2:>12}{3:>12}{4:>12}".format(
+        "span", "count", "total (s)", "mean (ms)", "max (ms)")]
+    for name, (number, total, longest) in sorted(
+            spans.items(), key=lambda item: -item[1][1]):
+        lines.append("{0:<24}{1:>10}{2:>12.3f}{3:>12.2f}{4:>12.2f}".format(
+            name, number, total, total / number * 1000, longest * 1000))
+
+    if counters:
+        lines.append("")
+        lines.append("{0:<24}{1:>10}".format("counter", "value"))
+        for name, value in sorted(counters.items()):
+            if isinstance(value, float):
+                lines.append("{0:<24}{1:>10.3f}".format(name, value))
+            else:
+                lines.append("{0:<24}{1:>10}".format(name, value))
+    return "\n".join(lines)
+
+
+class ChromeTrace(object):
+    def __init__(self, filename):
+        """A sink that collects every event and saves them to `filename` in
+        the Chrome trace event format (see chrome://tracing) when closed."""
+        super(ChromeTrace, self).__init__()
+
+        self.filename = filename
+        self._events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def close(self):
+        with self._lock:
+            events = list(self._events)
+        atomic_write(self.filename, json.dumps({
+            "traceEvents": events,
+            "displayTimeUnit": "ms"
+        }).encode("utf-8"))
@@ -0,0 +1,345 @@
+# coding=utf-8
+"""Long-lived worker processes that run build jobs, so that tools with an
+expensive startup (e.g. node based compilers) don't have to be spawned for
+every single file.
+
+Workers receive jobs on their standard input and reply on their standard
+output. Every message is a JSON object, prefixed by its length in bytes as a
+4 byte big-endian integer (see `write_frame`):
+
+* `{"id": n, "job": ...}` must be answered with `{"id": n, "result": ...}`
+  if the job succeeded, or `{"id": n, "error": "message"}` otherwise
+* `{"id": n, "ping": true}` must be answered with `{"id": n}` as soon as
+  possible; it is used to check that idle workers are still responsive
+
+Workers should exit as soon as their standard input is closed and may use
+their standard error for logging. `serve` implements all of the above for
+workers written in Python.
+
+"""
+from __future__ import absolute_import, unicode_literals, division
+from gulpless import cancel
+
+import subprocess
+import threading
+import termcolor
+import logging
+import struct
+import json
+import time
+import sys
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+__all__ = ["read_frame", "write_frame", "serve", "Worker", "WorkerPool",
+           "register", "call", "close"]
+
+
+_header = struct.Struct(">I")
+
+
+def write_frame(f, message):
+    """Writes the JSON-serializable `message` to the binary stream `f`."""
+    data = json.dumps(message).encode("utf-8")
+    f.write(_header.pack(len(data)) + data)
+    f.flush()
+
+
+def read_frame(f):
+    """Reads a message written by `write_frame` from the binary stream `f`.
+    Returns None if the stream ends before a whole message was read."""
+    header = _read(f, _header.size)
+    if header is None:
+        return None
+    data = _read(f, _header.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _read(f, size):
+    chunks = []
+    while size:
+        chunk = f.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def serve(function, stdin=None, stdout=None):
+    """Runs a worker that calls `function` with every job it receives and
+    replies with its (JSON-serializable) result, until its input is closed.
+    Exceptions raised by `function` are reported back as job errors. While
+    serving, `sys.stdout` is redirected to `sys.stderr` so that stray prints
+    don't corrupt the replies."""
+    stdin = stdin or getattr(sys.stdin, "buffer", sys.stdin)
+    stdout = stdout or getattr(sys.stdout, "buffer", sys.stdout)
+
+    previous, sys.stdout = sys.stdout, sys.stderr
+    try:
+        while True:
+            request = read_frame(stdin)
+            if request is None:
+                break
+
+            reply = {"id": request["id"]}
+            if "job" in request:
+                try:
+                    reply["result"] = function(request["job"])
+                except Exception as e:
+                    reply["error"] = "{0}".format(e) or type(e).__name__
+            write_frame(stdout, reply)
+    finally:
+        sys.stdout = previous
+
+
+class _Died(EnvironmentError):
+    """Raised when a worker exits or stops responding."""
+
+
+class Worker(object):
+    def __init__(self, cmdline):
+        """Starts `cmdline` as a worker process. Its standard error is
+        inherited, so it can log as usual."""
+        super(Worker, self).__init__()
+
+        self.cmdline = cmdline
+        self.used = time.time()  # when the worker last replied
+        self._process = subprocess.Popen(cmdline, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+        self._replies = queue.Queue()
+        self._id = 0
+
+        thread = threading.Thread(target=self._receive)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def alive(self):
+        """Whether the worker process is still running."""
+        return self._process.poll() is None
+
+    def call(self, job, timeout=None):
+        """Sends `job` to the worker and returns its result. An
+        EnvironmentError is raised if the job fails, or if the worker exits or
+        doesn't reply within `timeout` seconds."""
+        reply = self._request({"job": job}, timeout)
+        if "error" in reply:
+            raise EnvironmentError(reply["error"])
+        return reply.get("result")
+
+    def ping(self, timeout=5):
+        """Returns whether the worker replies to a ping within `timeout`
+        seconds."""
+        try:
+            self._request({"ping": True}, timeout)
+            return True
+        except _Died:
+            return False
+
+    def close(self, timeout=1):
+        """Closes the worker's input and waits up to `timeout` seconds for it
+        to exit before killing it."""
+        try:
+            self._process.stdin.close()
+        except EnvironmentError:
+            pass
+
+        deadline = time.time() + timeout
+        while self._process.poll() is None and time.time() < deadline:
+            time.sleep(0.01)
+        if self._process.poll() is None:
+            self._kill()
+
+    def _request(self, message, timeout):
+        self._id += 1
+        message["id"] = self._id
+        try:
+            write_frame(self._process.stdin, message)
+        except (EnvironmentError, ValueError):
+            # broken pipe or closed file
+            raise _Died("{0} exited with code {1}".format(
+                self.cmdline[0], self._process.wait()))
+
+        while True:
+            try:
+                reply = self._replies.get(timeout=timeout)
+            except queue.Empty:
+                self._kill()
+                raise _Died("{0} did not reply within {1}s".format(
+                    self.cmdline[0], timeout))
+
+            if reply is None:
+                raise _Died("{0} exited with code {1}".format(
+                    self.cmdline[0], self._process.wait()))
+            if reply.get("id") == self._id:
+                self.used = time.time()
+                return reply
+
+    def _receive(self):
+        # replies are read by a separate thread so that requests can time out
+        # on every platform
+        try:
+            while True:
+                reply = read_frame(self._process.stdout)
+                self._replies.put(reply)
+                if reply is None:
+                    break
+        except (EnvironmentError, ValueError):
+            self._replies.put(None)
+
+    def _kill(self):
+        try:
+            self._process.kill()
+        except EnvironmentError:
+            pass
+        self._process.wait()
+
+
+class WorkerPool(object):
+    def __init__(self, cmdline, size=1, fallback=None, timeout=None,
+                 ping=30, retries=1):
+        """Runs jobs on up to `size` instances of the worker `cmdline`, which
+        are started as needed and kept alive in between jobs. Workers that
+        have been idle for more than `ping` seconds are checked before being
+        reused. If a worker crashes (or doesn't reply within `timeout`
+        seconds), it is restarted and its job is retried up to `retries`
+        times. `fallback`, if not None, is a function that returns the command
+        line of a process that runs a single job; it is used when `cmdline` is
+        None, `size` is 0, or the workers can't be started at all."""
+        super(WorkerPool, self).__init__()
+
+        self.cmdline = cmdline
+        self.size = size
+        self.fallback = fallback
+        self.timeout = timeout
+        self.ping = ping
+        self.retries = retries
+
+        self._slots = threading.Semaphore(max(size, 1))
+        self._lock = threading.Lock()
+        self._idle = []  # a stack of workers that aren't running any job
+        self._broken = not cmdline or size <= 0
+
+    def call(self, job):
+        """Runs `job` on one of the workers and returns its result."""
+        if self._broken:
+            return self._spawn(job)
+
+        with self._slots:
+            for attempt in range(self.retries + 1):
+                worker = self._acquire()
+                if worker is None:
+                    return self._spawn(job)
+
+                try:
+                    # the worker is killed if the build is cancelled, as it
+                    # would otherwise keep running an obsolete job
+                    with cancel.watch(worker._kill):
+                        result = worker.call(job, self.timeout)
+                except _Died as e:
+                    if cancel.cancelled():
+                        worker.close()
+                        raise cancel.Cancelled()
+                    logging.warning("Restarting {0}: {1}".format(
+                        termcolor.colored(self.cmdline[0], "yellow",
+                                          attrs=["bold"]),
+                        e.args[0]
+                    ))
+                    worker.close()
+                    error = e
+                    continue
+                except EnvironmentError:
+                    # the job failed, but the worker is fine
+                    self._release(worker)
+                    raise
+
+                self._release(worker)
+                return result
+        raise EnvironmentError(error.args[0])
+
+    def close(self):
+        """Stops every idle worker."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+
+    def _acquire(self):
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+
+        if worker is not None:
+            if \
+                    not worker.alive or \
+                    time.time() - worker.used >= self.ping and \
+                    not worker.ping(self.timeout or 5):
+                logging.warning("Restarting unresponsive {0}".format(
+                    termcolor.colored(self.cmdline[0], "yellow",
+                                      attrs=["bold"])))
+                worker.close()
+                worker = None
+
+        if worker is None:
+            try:
+                worker = Worker(self.cmdline)
+            except EnvironmentError as e:
+                if self.fallback is None:
+                    raise EnvironmentError("Unable to start {0}: {1}".format(
+                        self.cmdline[0], e))
+                logging.warning("Unable to start {0}; running one process per "
+                                "job instead: {1}".format(self.cmdline[0], e))
+                self._broken = True
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def _spawn(self, job):
+        if self.fallback is None:
+            raise EnvironmentError("No worker available for {0}".format(job))
+
+        cmdline = self.fallback(job)
+        try:
+            code = cancel.call(cmdline)
+        except EnvironmentError as e:
+            raise EnvironmentError("Unable to start {0}: {1}".format(
+                cmdline[0], e))
+        if code != 0:
+            raise EnvironmentError("Non-zero exit code in {0}".format(
+                cmdline[0]))
+
+
+_pools = {}  # maps tool names to their worker pool
+
+
+def register(name, cmdline, size=1, **kwargs):
+    """Creates the worker pool that `call` uses for `name`; see `WorkerPool`
+    for the arguments. Any previous pool with the same name is closed."""
+    previous = _pools.get(name)
+    _pools[name] = WorkerPool(cmdline, size, **kwargs)
+    if previous is not None:
+        previous.close()
+    return _pools[name]
+
+
+def call(name, job):
+    """Runs `job` on the worker pool that was registered as `name`."""
+    try:
+        pool = _pools[name]
+    except KeyError:
+        raise ValueError("Unknown tool '{0}'".format(name))
+    return pool.call(job)
+
+
+def close():
+    """Stops the idle workers of every pool."""
+    for pool in list(_pools.values()):
+        pool.close()
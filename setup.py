@@ -9,6 +9,5 @@ setup(name="gulpless",
       author_email="za_creature@yahoo.com",
       url="https://github.com/za-creature/gulpless",
       packages=["gulpless"],
-      install_requires=["watchdog", "termcolor", "colorama", "pathtools",
-                        "argparse"],
+      install_requires=["watchdog", "termcolor", "colorama", "argparse"],
       entry_points={"console_scripts": ["gulpless=gulpless:main"]})
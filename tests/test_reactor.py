@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals, division
+from gulpless.compress import compress
+from gulpless.handlers import Handler
+from gulpless.reactor import Reactor
+
+import unittest
+import tempfile
+import shutil
+import os
+
+
+class CompressHandler(Handler):
+    optional = [".gz"]
+
+    def __init__(self, patterns):
+        super(CompressHandler, self).__init__(patterns, suffixes=["", ".gz"])
+        self.built = []
+
+    def build(self, input_path, output_paths):
+        self.built.append(input_path)
+        super(CompressHandler, self).build(input_path, output_paths[:1])
+        compress(input_path, output_paths[1])
+
+
+class RestartTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="gulpless-test-")
+        self.src = os.path.join(self.root, "src")
+        self.dest = os.path.join(self.root, "dest")
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def build(self):
+        handler = CompressHandler(["*.txt"])
+        reactor = Reactor(self.src, self.dest,
+                          state=os.path.join(self.root, "state"))
+        reactor.add_handler(handler)
+        self.assertTrue(reactor.build())
+        return handler.built
+
+    def test_skipped_optional_output(self):
+        # too small to be worth compressing
+        with open(os.path.join(self.src, "tiny.txt"), "wb") as f:
+            f.write(b"x")
+
+        self.assertEqual(len(self.build()), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.dest,
+                                                     "tiny.txt.gz")))
+        self.assertEqual(self.build(), [])
+        self.assertEqual(self.build(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()